@@ -4,12 +4,99 @@
 Gestionnaire de données pour les blocs et spans
 """
 
-from typing import List, Dict, Any, Optional
+import heapq
+import itertools
+import logging
+import string
+import time
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Au-delà de ce nombre de spans par page, le tri vectorisé NumPy l'emporte
+NUMPY_SORT_THRESHOLD = 500
+
+
+_BASE36_DIGITS = string.digits + string.ascii_lowercase
+
+
+def _to_base36(value: int) -> str:
+    """Encoder un entier positif en base 36"""
+    digits = []
+    while True:
+        value, remainder = divmod(value, 36)
+        digits.append(_BASE36_DIGITS[remainder])
+        if value == 0:
+            return ''.join(reversed(digits))
+
+
+def _stats_for_blocks(blocks: Iterable[Dict[str, Any]]) -> Tuple[int, int, int]:
+    """
+    Compter les blocs d'une page
+    
+    Args:
+        blocks: Blocs MinerU de la page (liste ou itérateur)
+        
+    Returns:
+        Tuple (total, matched, manual)
+    """
+    total = matched = manual = 0
+    for b in blocks:
+        total += 1
+        if b.get('matching_spans'):
+            matched += 1
+        if b.get('match_source') == 'manual':
+            manual += 1
+    return total, matched, manual
+
+
+def _span_position(span: Dict[str, Any]) -> Tuple[float, float]:
+    """Clé de tri d'un span : haut en bas, gauche à droite"""
+    bbox = span['bbox_pixels']
+    return (bbox[1], bbox[0])
+
+
+def _sort_spans_by_position(span_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Trier par position les spans de plusieurs blocs
+    
+    Le tri est stable : à position égale, l'ordre des blocs est conservé.
+    
+    Args:
+        span_lists: Listes de spans (une par bloc)
+        
+    Returns:
+        Liste unique de spans triés
+    """
+    total = sum(len(spans) for spans in span_lists)
+    
+    if total > NUMPY_SORT_THRESHOLD:
+        # Grandes pages (PDF scannés) : tri lexicographique en C
+        flat = [span for spans in span_lists for span in spans]
+        ys = np.fromiter((s['bbox_pixels'][1] for s in flat), dtype=np.float64, count=total)
+        xs = np.fromiter((s['bbox_pixels'][0] for s in flat), dtype=np.float64, count=total)
+        order = np.lexsort((xs, ys))
+        return [flat[i] for i in order.tolist()]
+    
+    # Les spans d'un bloc sont déjà quasi ordonnés : le tri par bloc est
+    # presque linéaire, puis fusion des séquences triées (O(N log B))
+    sorted_runs = [sorted(spans, key=_span_position) for spans in span_lists if spans]
+    return list(heapq.merge(*sorted_runs, key=_span_position))
 
 
 class DataManager:
     """Gestion centralisée des données de blocs et spans"""
     
+    # Types exclus des blocs MinerU (spans isolés et blocs sans type)
+    _EXCLUDED_BLOCK_TYPES = frozenset({'isolated_span', None, ''})
+    
+    __slots__ = (
+        '_enriched_data', 'page_dimensions', 'current_page',
+        '_id_index', '_merge_index', '_merge_counter',
+    )
+    
     def __init__(self, enriched_data: List[List[Dict[str, Any]]]):
         """
         Initialiser le gestionnaire de données
@@ -19,12 +106,97 @@ class DataManager:
         """
         # self.enriched_data = enriched_data
         # self.current_page = 0
+        # Index id de bloc -> (page, position), reconstruit à la demande
+        self._id_index: Dict[str, Tuple[int, int]] = {}
+        # Groupes de fusion : merge_group_id -> blocs membres
+        self._merge_index: Dict[str, List[Dict[str, Any]]] = {}
+        # Départage les fusions créées dans la même nanoseconde
+        self._merge_counter = itertools.count()
         self.enriched_data = enriched_data if enriched_data is not None else []
         self.page_dimensions = {}
         self.current_page = 0
-       
 
+    @property
+    def enriched_data(self) -> List[List[Dict[str, Any]]]:
+        """Données enrichies par page"""
+        return self._enriched_data
+
+    @enriched_data.setter
+    def enriched_data(self, value: List[List[Dict[str, Any]]]) -> None:
+        # Remplacement complet (undo/redo) : index reconstruits
+        self._enriched_data = value
+        self._build_id_index()
+        self._build_merge_index()
+
+    def _build_id_index(self) -> None:
+        """Reconstruire l'index des blocs par ID"""
+        self._id_index = {
+            block['id']: (page_idx, block_idx)
+            for page_idx, page_blocks in enumerate(self.enriched_data)
+            if isinstance(page_blocks, list)
+            for block_idx, block in enumerate(page_blocks)
+            if isinstance(block, dict) and 'id' in block
+        }
+
+    def _locate_block(self, block_id: str) -> Optional[Tuple[int, int]]:
+        """
+        Localiser un bloc via l'index
+        
+        L'interface modifie enriched_data directement (ajout/suppression de
+        blocs, undo/redo) : une entrée périmée déclenche une reconstruction.
+        
+        Args:
+            block_id: ID du bloc recherché
+            
+        Returns:
+            Tuple (page, position) ou None si introuvable
+        """
+        location = self._id_index.get(block_id)
+        if location is not None:
+            page_idx, block_idx = location
+            try:
+                block = self.enriched_data[page_idx][block_idx]
+                if isinstance(block, dict) and block.get('id') == block_id:
+                    return location
+            except (IndexError, TypeError, KeyError):
+                pass
+        
+        self._build_id_index()
+        return self._id_index.get(block_id)
+
+    def _build_merge_index(self) -> None:
+        """Reconstruire l'index des groupes de fusion"""
+        self._merge_index = {}
+        for page_blocks in self.enriched_data:
+            if isinstance(page_blocks, list):
+                for block in page_blocks:
+                    if isinstance(block, dict) and "merge_group_id" in block:
+                        self._merge_index.setdefault(block["merge_group_id"], []).append(block)
+        
+        # Membres rangés par merge_order une fois pour toutes : merge_blocks
+        # insère dans cet ordre et unmerge_blocks le préserve
+        for members in self._merge_index.values():
+            members.sort(key=lambda b: b.get("merge_order", 0))
+
+    def _get_merge_index(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Index des groupes de fusion, vérifié avant usage
+        
+        Chaque membre doit toujours porter son merge_group_id et figurer dans
+        enriched_data (un bloc peut avoir été supprimé par l'interface).
         
+        Returns:
+            Dict {merge_group_id: [blocs]}
+        """
+        for group_id, members in self._merge_index.items():
+            for block in members:
+                location = self._locate_block(block.get("id"))
+                if (block.get("merge_group_id") != group_id or location is None
+                        or self.enriched_data[location[0]][location[1]] is not block):
+                    self._build_merge_index()
+                    return self._merge_index
+        return self._merge_index
+
     def get_page_blocks(self, page_num: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Récupérer les blocs d'une page
@@ -52,11 +224,25 @@ class DataManager:
         Returns:
             Liste des blocs MinerU
         """
-        page_blocks = self.get_page_blocks(page_num)
-        return [
-            b for b in page_blocks 
-            if b.get('block_type') and b.get('block_type') != 'isolated_span'
-        ]
+        return list(self.iter_mineru_blocks(page_num))
+    
+    def iter_mineru_blocks(self, page_num: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Parcourir les blocs MinerU d'une page sans construire de liste
+        
+        Args:
+            page_num: Numéro de page
+            
+        Returns:
+            Itérateur sur les blocs MinerU
+        """
+        if page_num is None:
+            page_num = self.current_page
+        
+        return (
+            b for b in self.get_page_blocks(page_num)
+            if b.get('block_type') not in self._EXCLUDED_BLOCK_TYPES
+        )
     
     def get_all_spans(self, page_num: Optional[int] = None) -> List[Dict[str, Any]]:
         """
@@ -69,15 +255,9 @@ class DataManager:
             Liste de tous les spans (triés par position)
         """
         page_blocks = self.get_page_blocks(page_num)
-        all_spans = []
-        
-        for block in page_blocks:
-            all_spans.extend(block.get('matching_spans', []))
-        
-        # Trier par position (haut en bas, gauche à droite)
-        all_spans.sort(key=lambda s: (s['bbox_pixels'][1], s['bbox_pixels'][0]))
-        
-        return all_spans
+        return _sort_spans_by_position(
+            [block.get('matching_spans', []) for block in page_blocks]
+        )
     
     def get_unmatched_spans(self, page_num: Optional[int] = None) -> List[Dict[str, Any]]:
         """
@@ -87,10 +267,13 @@ class DataManager:
             page_num: Numéro de page
             
         Returns:
-            Liste des spans sans correspondance
+            Liste des spans sans correspondance (triés par position)
         """
-        all_spans = self.get_all_spans(page_num)
-        return [s for s in all_spans if s.get('matched_to_block') is None]
+        # Filtrer avant de trier : seuls les spans non matchés sont triés
+        return _sort_spans_by_position([
+            [s for s in block.get('matching_spans', []) if s.get('matched_to_block') is None]
+            for block in self.get_page_blocks(page_num)
+        ])
     
     def link_spans_to_block(self, block: Dict[str, Any], spans: List[Dict[str, Any]]) -> None:
         """
@@ -100,16 +283,13 @@ class DataManager:
             block: Bloc cible
             spans: Liste des spans à lier
         """
-        # Créer copie des spans pour éviter références
-        new_spans = [span.copy() for span in spans]
+        # Copier les spans (éviter les références) en les marquant comme matchés
+        block_id = block['id']
+        new_spans = [{**span, 'matched_to_block': block_id} for span in spans]
         
         # Mettre à jour le bloc
         block['matching_spans'] = new_spans
         block['match_source'] = 'manual'
-        
-        # Marquer les spans comme matchés
-        for span in new_spans:
-            span['matched_to_block'] = block['id']
     
     def unlink_block(self, block: Dict[str, Any]) -> None:
         """
@@ -136,16 +316,15 @@ class DataManager:
         Returns:
             Dict avec total, matched, manual
         """
-        if page_num is not None:
-            blocks = self.get_mineru_blocks(page_num)
-        else:
-            blocks = []
-            for i in range(len(self.enriched_data)):
-                blocks.extend(self.get_mineru_blocks(i))
+        pages = [page_num] if page_num is not None else range(len(self.enriched_data))
         
-        total = len(blocks)
-        matched = len([b for b in blocks if b.get('matching_spans')])
-        manual = len([b for b in blocks if b.get('match_source') == 'manual'])
+        # Sommer les compteurs par page
+        total = matched = manual = 0
+        for i in pages:
+            page_stats = _stats_for_blocks(self.iter_mineru_blocks(i))
+            total += page_stats[0]
+            matched += page_stats[1]
+            manual += page_stats[2]
         
         return {
             'total': total,
@@ -165,44 +344,46 @@ class DataManager:
         Returns:
             Bloc trouvé ou None
         """
-        page_blocks = self.get_page_blocks(page_num)
-        for block in page_blocks:
-            if block.get('id') == block_id:
-                return block
-        return None
+        if page_num is None:
+            page_num = self.current_page
+        
+        location = self._locate_block(block_id)
+        if location is None or location[0] != page_num:
+            return None
+        return self.enriched_data[location[0]][location[1]]
         
     def merge_blocks(self, block_ids: List[str]) -> str:
         """Fusionner plusieurs blocs en un groupe"""
         if len(block_ids) < 2:
             raise ValueError("Au moins 2 blocs requis pour fusionner")
         
-        import time
-        merge_group_id = f"MERGE_{int(time.time() * 1000) % 1000000}"
+        # Horodatage ns (13 caractères en base 36) + compteur : pas de collision
+        # entre fusions rapprochées, même au sein de la même milliseconde
+        merge_group_id = (
+            f"MERGE_{_to_base36(time.time_ns())}{_to_base36(next(self._merge_counter))}"
+        )
         
-        print(f"\n=== MERGE_BLOCKS DEBUG ===")
-        print(f"Block IDs to merge: {block_ids}")
-        print(f"Merge group ID: {merge_group_id}")
-        print(f"enriched_data type: {type(self.enriched_data)}")
-        print(f"enriched_data length: {len(self.enriched_data)}")
+        logger.debug("merge_blocks: %s -> %s", block_ids, merge_group_id)
         
-        matched_count = 0
-        for page_idx, page_blocks in enumerate(self.enriched_data):
-            print(f"\nPage {page_idx}: type={type(page_blocks)}, len={len(page_blocks) if isinstance(page_blocks, list) else 'N/A'}")
-            
-            if isinstance(page_blocks, list):
-                for block_idx, block in enumerate(page_blocks):
-                    if isinstance(block, dict):
-                        block_id = block.get("id")
-                        if block_id in block_ids:
-                            print(f"  ✓ Found block {block_id} at index {block_idx}")
-                            block["merge_group_id"] = merge_group_id
-                            block["merge_order"] = block_ids.index(block_id)
-                            matched_count += 1
-                            print(f"    → merge_group_id set to {merge_group_id}")
-                            print(f"    → merge_order set to {block_ids.index(block_id)}")
-        
-        print(f"\nTotal matched: {matched_count}/{len(block_ids)}")
-        print(f"=== END MERGE_BLOCKS DEBUG ===\n")
+        # Ordre de fusion = première position de l'ID dans block_ids
+        order_map = {}
+        for order, block_id in enumerate(block_ids):
+            order_map.setdefault(block_id, order)
+        
+        members = []
+        for block_id, order in order_map.items():
+            location = self._locate_block(block_id)
+            if location is None:
+                continue
+            block = self.enriched_data[location[0]][location[1]]
+            block["merge_group_id"] = merge_group_id
+            block["merge_order"] = order
+            members.append(block)
+        
+        if members:
+            self._merge_index[merge_group_id] = members
+        
+        logger.debug("merge_blocks: %d/%d blocs trouvés", len(members), len(block_ids))
         
         return merge_group_id
 
@@ -215,13 +396,28 @@ class DataManager:
         Args:
             block_ids: Liste des IDs de blocs à défusionner
         """
-        # ✅ CORRECTION : enriched_data est une liste de LISTES
-        for page_blocks in self.enriched_data:  # ← page_blocks est une LISTE
-            if isinstance(page_blocks, list):
-                for block in page_blocks:
-                    if isinstance(block, dict) and block.get("id") in block_ids:
-                        block.pop("merge_group_id", None)
-                        block.pop("merge_order", None)
+        # Blocs retirés, regroupés par groupe de fusion
+        removed_by_group: Dict[str, set] = {}
+        for block_id in set(block_ids):
+            location = self._locate_block(block_id)
+            if location is None:
+                continue
+            block = self.enriched_data[location[0]][location[1]]
+            group_id = block.pop("merge_group_id", None)
+            block.pop("merge_order", None)
+            if group_id is not None:
+                removed_by_group.setdefault(group_id, set()).add(id(block))
+        
+        # Un seul filtrage par groupe touché (suppression directe si vidé)
+        for group_id, removed in removed_by_group.items():
+            members = self._merge_index.get(group_id)
+            if members is None:
+                continue
+            remaining = [b for b in members if id(b) not in removed]
+            if remaining:
+                self._merge_index[group_id] = remaining
+            else:
+                del self._merge_index[group_id]
 
 
     def get_merged_blocks_groups(self) -> Dict[str, List[dict]]:
@@ -231,22 +427,8 @@ class DataManager:
         Returns:
             Dict: {merge_group_id: [block1, block2, ...]}
         """
-        groups = {}
-        # ✅ CORRECTION : enriched_data est une liste de LISTES
-        for page_blocks in self.enriched_data:  # ← page_blocks est une LISTE
-            if isinstance(page_blocks, list):
-                for block in page_blocks:
-                    if isinstance(block, dict) and "merge_group_id" in block:
-                        gid = block["merge_group_id"]
-                        if gid not in groups:
-                            groups[gid] = []
-                        groups[gid].append(block)
-        
-        # Trier chaque groupe par merge_order
-        for gid in groups:
-            groups[gid].sort(key=lambda b: b.get("merge_order", 0))
-        
-        return groups
+        # Groupes déjà triés par merge_order dans l'index
+        return {gid: list(members) for gid, members in self._get_merge_index().items()}
 
     def export_merged_groups_for_translation(self):
         """
@@ -257,34 +439,12 @@ class DataManager:
         """
         export_data = {}
         
-        for page_blocks in self.enriched_data:
-            for block in page_blocks:
-                if "merge_group_id" in block:
-                    group_id = block["merge_group_id"]
-                    
-                    # Créer l'entrée si elle n'existe pas
-                    if group_id not in export_data:
-                        export_data[group_id] = {
-                            "text": "",
-                            "block_ids": [],
-                            "texts_by_order": {}
-                        }
-                    
-                    # Ajouter le bloc à la liste
-                    export_data[group_id]["block_ids"].append(block.get("id"))
-                    
-                    # Récupérer le texte avec l'ordre de fusion
-                    merge_order = block.get("merge_order", 0)
-                    text = block.get("text", "")
-                    export_data[group_id]["texts_by_order"][merge_order] = text
-        
-        # Combiner les textes dans l'ordre merge_order
-        for group_id, data in export_data.items():
-            texts_ordered = [
-                data["texts_by_order"][i] 
-                for i in sorted(data["texts_by_order"].keys())
-            ]
-            data["text"] = "\n".join(texts_ordered)  # Joindre avec newline
+        # Groupes déjà triés par merge_order dans l'index
+        for group_id, blocks in self._get_merge_index().items():
+            export_data[group_id] = {
+                "text": "\n".join(b.get("text", "") for b in blocks),  # Joindre avec newline
+                "block_ids": [b.get("id") for b in blocks]
+            }
         
         return export_data
 
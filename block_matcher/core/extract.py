@@ -8,13 +8,229 @@ Usage: python generate_dual_output.py <PDF_FILE> <MINERU_JSON> [base_name]
 """
 
 import fitz  # PyMuPDF
+import bisect
+import itertools
 import json
+import numpy as np
 import os
+import pickle
 import sys
 from typing import List, Dict, Any, Tuple
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import re
 
+# Motifs compilés une fois pour toutes (appelés pour chaque bloc)
+_LIST_DASH_RE = re.compile(r'^\s*[\-\*]\s')
+_LIST_NUM_RE = re.compile(r'^\s*\d+\.\s')
+_SVG_RE = re.compile(r'<svg\s+id="([^"]+)"/>')
+
+
+def _collapse_whitespace(text: str) -> str:
+    """
+    Équivalent de re.sub(r'\s+', ' ', text) sans passer par le moteur regex.
+
+    Les espaces de début et de fin sont réduits à un seul, pas supprimés.
+    """
+    collapsed = ' '.join(text.split())
+    if not collapsed:
+        return ' ' if text else ''
+    if text[0].isspace():
+        collapsed = ' ' + collapsed
+    if text[-1].isspace():
+        collapsed += ' '
+    return collapsed
+
+
+def _tidy_styled_content(text: str) -> str:
+    """Réduit les espaces puis retire ceux qui précèdent une balise fermante ou séparent deux balises"""
+    return _collapse_whitespace(text).replace(' </', '</').replace('> <', '><')
+
+
+# Au-delà de ce nombre de blocs par page, le tri vectorisé NumPy l'emporte
+NUMPY_SORT_THRESHOLD = 500
+
+# En deçà de ce nombre de pages, le démarrage d'un pool de processus coûte plus qu'il ne rapporte
+PARALLEL_MIN_PAGES = 8
+
+# Processus du pool en ligne de commande (l'interface reste séquentielle)
+CLI_MAX_WORKERS = 4
+
+# Bits de span["flags"] PyMuPDF
+_FLAG_SUPERSCRIPT = 1 << 0
+_FLAG_ITALIC = 1 << 1
+_FLAG_BOLD = 1 << 4
+
+# Couleur des spans dans le diagnostic selon match_quality (autres valeurs : _UNMATCHED_SPAN_COLOR)
+_MATCH_QUALITY_COLORS = {
+    'excellent': (0, 0, 1),
+    'good': (0, 0.5, 1),
+    'fair': (0.5, 0.5, 1),
+}
+_UNMATCHED_SPAN_COLOR = (0.8, 0.8, 1)
+
+# Propriétés de bloc recopiées telles quelles dans le format de mise en page, si présentes
+# (l'ordre fixe celui des clés dans le JSON)
+_FORMATTING_PASSTHROUGH_KEYS = ('is_list', 'list_bullet', 'list_indent', 'list_hang', 'svgs_in_block')
+
+
+def _span_flag(span: Dict, mask: int):
+    """
+    Lire un bit de style dans les flags PyMuPDF du span.
+
+    Returns:
+        bool, ou None si le span n'a pas de flags (span créé hors extraction)
+    """
+    flags = span.get('flags')
+    return None if flags is None else bool(flags & mask)
+
+
+def _style_key(style: Dict) -> Tuple:
+    """Clé (police, taille, couleur) d'un dict de style"""
+    return (style.get('police'), style.get('taille'), style.get('couleur'))
+
+
+def _span_style_key(span: Dict) -> Tuple:
+    """Clé (police, taille, couleur) d'un span, comparable à _style_key"""
+    return (span.get('font_name'), span.get('font_size'), span.get('color_rgb'))
+
+
+def _size_bucket(raw_size) -> int:
+    """Taille de police en pas entiers de 0.2 pt, arrondie par round(size / 0.2) (taille invalide : 0)"""
+    try:
+        size = float(raw_size)
+    except (TypeError, ValueError):
+        size = 0.0
+    return round(size / 0.2)
+
+
+def _quantize_bbox(bbox) -> Tuple[int, int, int, int]:
+    """Clé entière d'une bbox en pixels, au centième de pixel"""
+    x0, y0, x1, y1 = bbox
+    return (round(x0 * 100), round(y0 * 100), round(x1 * 100), round(y1 * 100))
+
+
+def _overlap_mask(bboxes: np.ndarray, block_bbox: List, tolerance: float) -> np.ndarray:
+    """
+    Test d'inclusion de DualOutputGenerator._spans_overlap appliqué à un tableau (K, 4) de bbox.
+
+    Returns:
+        Masque booléen de longueur K
+    """
+    return ((bboxes[:, 0] >= block_bbox[0] - tolerance) &
+            (bboxes[:, 1] >= block_bbox[1] - tolerance) &
+            (bboxes[:, 2] <= block_bbox[2] + tolerance) &
+            (bboxes[:, 3] <= block_bbox[3] + tolerance))
+
+class StreamingJsonArrayWriter:
+    """
+    Écrit un tableau JSON élément par élément, avec la même mise en forme que
+    json.dump(..., indent=2, ensure_ascii=False) : seul l'élément courant est
+    sérialisé en mémoire.
+
+    Args:
+        f: Fichier texte ouvert en écriture
+        level: Profondeur d'imbrication du tableau dans le document (0 = racine)
+    """
+
+    INDENT = 2
+
+    def __init__(self, f, level: int = 0):
+        self.f = f
+        self.level = level
+        self.count = 0
+
+    def encode(self, obj, level: int) -> str:
+        """Sérialiser obj tel qu'il apparaîtrait à la profondeur level"""
+        text = json.dumps(obj, indent=self.INDENT, ensure_ascii=False)
+        # Les chaînes JSON n'ont jamais de saut de ligne brut : seul l'indentation est décalée
+        return text.replace('\n', '\n' + ' ' * (self.INDENT * level))
+
+    def write(self, item):
+        pad = ' ' * (self.INDENT * (self.level + 1))
+        self.f.write(('[\n' if self.count == 0 else ',\n') + pad)
+        self.f.write(self.encode(item, self.level + 1))
+        self.count += 1
+
+    def close(self):
+        if self.count == 0:
+            self.f.write('[]')
+        else:
+            self.f.write('\n' + ' ' * (self.INDENT * self.level) + ']')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        return False
+
+
+class SpanIndex:
+    """
+    Colonnes NumPy des spans d'une page, pour la recherche géométrique.
+
+    Les spans restent des dicts (format de sortie) ; l'index n'en garde que
+    les bbox normalisées, triées par y0, et l'état "déjà attribué" de chacun.
+
+    Args:
+        spans: Spans PyMuPDF de la page (cf. _extract_pymupdf_spans_detailed)
+    """
+
+    __slots__ = ('sorted_y0', 'order', 'bboxes', 'matched')
+
+    def __init__(self, spans: List[Dict]):
+        order = sorted(range(len(spans)), key=lambda i: spans[i]['bbox_normalized'][1])
+        self.sorted_y0 = [spans[i]['bbox_normalized'][1] for i in order]
+        self.order = np.array(order, dtype=np.int64)
+        self.bboxes = np.array([spans[i]['bbox_normalized'] for i in order], dtype=np.float64).reshape(-1, 4)
+        self.matched = np.zeros(len(spans), dtype=bool)
+
+    def candidates(self, block_bbox: List, tolerance: float) -> List[int]:
+        """
+        Indices (ordre d'origine) des spans non attribués contenus dans block_bbox.
+        """
+        # Un span contenu dans le bloc a son y0 dans [y0 - tol, y1 + tol]
+        lo = bisect.bisect_left(self.sorted_y0, block_bbox[1] - tolerance)
+        hi = bisect.bisect_right(self.sorted_y0, block_bbox[3] + tolerance)
+        idx = self.order[lo:hi][_overlap_mask(self.bboxes[lo:hi], block_bbox, tolerance)]
+        return np.sort(idx[~self.matched[idx]]).tolist()
+
+    def mark_matched(self, indices: List[int]):
+        self.matched[indices] = True
+
+    def unmatched(self) -> List[int]:
+        """Indices des spans jamais attribués, dans l'ordre d'origine"""
+        return np.flatnonzero(~self.matched).tolist()
+
+
+# État propre à chaque processus du pool (cf. _process_with_visual_matching)
+_worker_generator = None
+_worker_doc = None
+
+
+def _init_page_worker(generator, pdf_path: str):
+    """Initialiser un processus du pool : copie du générateur + document ouvert une fois"""
+    global _worker_generator, _worker_doc
+    _worker_generator = generator
+    _worker_doc = fitz.open(pdf_path)
+
+
+def _process_page_worker(task: Tuple[int, Any]):
+    """
+    Traiter une page dans un processus du pool.
+
+    Returns:
+        (page_num, dimensions, bbox des spans texte, blocs enrichis)
+    """
+    page_num, page_data = task
+    enriched_page = _worker_generator._process_page(_worker_doc.load_page(page_num), page_num, page_data)
+    return (page_num, _worker_generator.page_dimensions[page_num],
+            _worker_generator._text_bboxes_by_page[page_num], enriched_page)
+
+
 class DualOutputGenerator:
     """Générateur pour les deux formats de sortie"""
     
@@ -46,7 +262,7 @@ class DualOutputGenerator:
                 for gs_key, style_dict in self.global_styles.items():
                     style_signature = (
                         style_dict.get('police', ''),
-                        style_dict.get('taille', 0),
+                        _size_bucket(style_dict.get('taille', 0)),
                         style_dict.get('couleur', 0)
                     )
                     self.style_mapping[style_signature] = gs_key
@@ -63,6 +279,9 @@ class DualOutputGenerator:
             self.block_additional_style_refs = {}
             print("[INFO] DualOutputGenerator initialisé avec styles globaux vides")
         
+        # Index inverse (police, taille, couleur) -> gsN et prochain numéro libre
+        self._reindex_global_styles()
+        
         self.diagnostic_colors = {
             'mineru_block': (0, 0.8, 0),
             'pymupdf_matched': (0, 0, 1),
@@ -72,7 +291,34 @@ class DualOutputGenerator:
             'background': (1, 1, 0.9),
         }
 
+        # Dicts de style canoniques, partagés entre blocs (cf. _intern_style)
+        self._style_intern: Dict[tuple, Dict] = {}
 
+        # Regex <tag>/</tag> compilées par ensemble de balises locales (cf. _replace_local_styles_with_global)
+        self._style_tag_re_cache: Dict[tuple, Any] = {}
+
+        # (police, taille brute, couleur) -> gsN, avant normalisation (cf. _get_or_create_formatting_style)
+        self._formatting_style_cache: Dict[tuple, str] = {}
+
+        # bbox des spans texte par page, relevées lors du matching (cf. create_clean_template)
+        self._text_bboxes_source = None
+        self._text_bboxes_by_page: Dict[int, List] = {}
+
+
+
+    def _intern_style(self, font, size, color) -> Dict:
+        """
+        Retourner le dict {'police', 'taille', 'couleur'} canonique pour ce style.
+
+        Le même objet est partagé par tous les blocs et spans de même style :
+        il ne doit pas être modifié en place.
+        """
+        # Types dans la clé : 12 == 12.0 mais ne se sérialisent pas pareil
+        key = (font, size, color, type(size), type(color))
+        style = self._style_intern.get(key)
+        if style is None:
+            style = self._style_intern[key] = {'police': font, 'taille': size, 'couleur': color}
+        return style
 
     def update_empty_block_style_from_first_span(self, block):
         """MET À JOUR default_style UNIQUEMENT si BLOC ÉTAIT VIDE et qu'on ajoute PREMIER span."""
@@ -81,11 +327,11 @@ class DualOutputGenerator:
         # UNIQUEMENT si le bloc était vide (0 span avant) et maintenant 1+ span
         if matching_spans and block.get('default_style', {}).get('police') == 'Unknown':
             first_span = next((s for s in matching_spans if s.get('font_name') and s.get('font_name') != 'Unknown'), matching_spans[0])
-            block['default_style'] = {
-                'police': first_span.get('font_name'),
-                'taille': first_span.get('font_size', 12.0),
-                'couleur': first_span.get('color_rgb', 0)
-            }
+            block['default_style'] = self._intern_style(
+                first_span.get('font_name'),
+                first_span.get('font_size', 12.0),
+                first_span.get('color_rgb', 0)
+            )
 
 
     def get_document_default_style(self):
@@ -104,25 +350,14 @@ class DualOutputGenerator:
 
         # Étape 1: Regrouper les spans en lignes en se basant sur leur coordonnée Y supérieure (y0)
         y_tolerance = 2.0  # Tolérance en pixels pour considérer que les spans sont sur la même ligne
-        lines = defaultdict(list)
-        for span in matching_spans:
-            y0 = span['bbox_pixels'][1]
-            found_line = False
-            # Chercher une ligne existante dans la tolérance
-            for line_y in lines.keys():
-                if abs(y0 - line_y) < y_tolerance:
-                    lines[line_y].append(span)
-                    found_line = True
-                    break
-            if not found_line:
-                lines[y0].append(span)
+        lines = self._group_spans_by_line(matching_spans, y_tolerance, inclusive=False)
 
         # S'il n'y a qu'une seule ligne détectée, on ne peut pas calculer d'interligne.
         if len(lines) < 2:
             return round(default_style.get('taille', 12.0) * 1.2, 2)
 
-        # Étape 2: Trier les coordonnées Y des lignes
-        sorted_line_y_coords = sorted(lines.keys())
+        # Étape 2: Coordonnées Y des lignes (déjà triées)
+        sorted_line_y_coords = [line_y for line_y, _ in lines]
 
         # Étape 3: Calculer les distances entre les débuts de lignes consécutives
         distances = []
@@ -140,8 +375,61 @@ class DualOutputGenerator:
         average_spacing = sum(distances) / len(distances)
         return round(average_spacing, 2)
 
-    def generate_dual_outputs(self, pdf_path: str, mineru_json_path: str = None, base_name: str = None):
-        """Générer les deux fichiers de sortie"""
+    def _group_spans_by_line(self, spans: List, y_tolerance: float, inclusive: bool = True) -> List[Tuple[float, List]]:
+        """
+        Regrouper des spans en lignes, dans leur ordre d'origine.
+
+        Chaque span rejoint la première ligne créée dont le y est dans la tolérance,
+        sinon il ouvre une nouvelle ligne à son y0. Les y des lignes sont tenus
+        triés : la recherche se fait par dichotomie au lieu de parcourir toutes
+        les lignes (au plus deux lignes voisines peuvent être dans la tolérance).
+
+        Args:
+            spans: Spans à regrouper
+            y_tolerance: Écart vertical maximal en pixels
+            inclusive: True pour un écart <= tolérance, False pour < tolérance
+
+        Returns:
+            Liste de (y de la ligne, spans de la ligne dans leur ordre d'origine), triée par y
+        """
+        if inclusive:
+            def within(line_y, y0):
+                return abs(y0 - line_y) <= y_tolerance
+        else:
+            def within(line_y, y0):
+                return abs(y0 - line_y) < y_tolerance
+
+        line_ys = []   # y des lignes, triés
+        lines = []     # (rang de création, y, spans), parallèle à line_ys
+
+        for span in spans:
+            y0 = span['bbox_pixels'][1]
+            pos = bisect.bisect_left(line_ys, y0)
+
+            # Lignes dans la tolérance de part et d'autre de y0 : la plus ancienne gagne
+            best = None
+            j = pos - 1
+            while j >= 0 and within(line_ys[j], y0):
+                if best is None or lines[j][0] < lines[best][0]:
+                    best = j
+                j -= 1
+            j = pos
+            while j < len(line_ys) and within(line_ys[j], y0):
+                if best is None or lines[j][0] < lines[best][0]:
+                    best = j
+                j += 1
+
+            if best is not None:
+                lines[best][2].append(span)
+            else:
+                line_ys.insert(pos, y0)
+                lines.insert(pos, (len(lines), y0, [span]))
+
+        return [(line_y, line_spans) for _, line_y, line_spans in lines]
+
+    def generate_dual_outputs(self, pdf_path: str, mineru_json_path: str = None, base_name: str = None,
+                              max_workers: int = 1):
+        """Générer les deux fichiers de sortie (max_workers : cf. _process_with_visual_matching)"""
 
         if base_name is None:
             base_name = os.path.splitext(os.path.basename(pdf_path))[0]
@@ -156,22 +444,17 @@ class DualOutputGenerator:
         print(f"Sortie traduction: {translation_file}")
         print(f"Sortie formatage: {formatting_file}")
 
+        # Un seul document ouvert pour le matching et le template
+        doc = fitz.open(pdf_path)
+
         # 1. Charger et analyser les données
         if self.enriched_data is None:
             mineru_data = self._load_mineru_data(mineru_json_path)
-            self.enriched_data = self._process_with_visual_matching(pdf_path, mineru_data)
-
-        # 2. Générer les deux formats
-        # ✅ MODIFICATION : Inverser l'ordre - formatage EN PREMIER
-        formatting_data = self._generate_formatting_format(self.enriched_data)
-        translation_data = self._generate_translation_format(self.enriched_data)
+            self.enriched_data = self._process_with_visual_matching(pdf_path, mineru_data, doc, max_workers)
 
-        # 3. Sauvegarder
-        with open(translation_file, 'w', encoding='utf-8') as f:
-            json.dump(translation_data, f, indent=2, ensure_ascii=False)
-
-        with open(formatting_file, 'w', encoding='utf-8') as f:
-            json.dump(formatting_data, f, indent=2, ensure_ascii=False)
+        # 2. Générer et sauvegarder les deux formats page par page
+        # (styles collectés en premier, puis un seul parcours)
+        self._write_both_formats(self.enriched_data, translation_file, formatting_file)
 
         print(f"\n✅ Fichiers JSON générés:")
         print(f"📝 {translation_file}")
@@ -179,7 +462,8 @@ class DualOutputGenerator:
 
         # Créer le template PDF sans texte
         template_file = f"{base_name}_template.pdf"
-        self.create_clean_template(pdf_path, template_file, self.enriched_data)
+        self.create_clean_template(pdf_path, template_file, self.enriched_data, doc)
+        doc.close()
 
         print(f"\n✅ Tous les fichiers générés:")
         print(f"📝 {translation_file}")
@@ -202,74 +486,139 @@ class DualOutputGenerator:
             print(f"❌ Erreur: {e}")
             raise
 
-    def _process_with_visual_matching(self, pdf_path: str, mineru_data: List):
-        """Traiter avec matching visuel robuste"""
+    def _process_with_visual_matching(self, pdf_path: str, mineru_data: List, doc: fitz.Document = None, max_workers: int = 1):
+        """
+        Traiter avec matching visuel robuste
+
+        Les pages sont indépendantes : avec max_workers > 1 et à partir de
+        PARALLEL_MIN_PAGES pages, elles sont réparties sur un pool de processus,
+        chacun ouvrant son propre document.
+
+        Args:
+            doc: Document déjà ouvert sur pdf_path (sinon ouvert et fermé ici)
+            max_workers: Nombre de processus (défaut : 1, séquentiel)
+        """
         print("\n🔗 Matching visuel et enrichissement...")
 
-        doc = fitz.open(pdf_path)
+        owns_doc = doc is None
+        if owns_doc:
+            doc = fitz.open(pdf_path)
+        self._text_bboxes_source = pdf_path
+        self._text_bboxes_by_page = {}
+
+        page_count = min(len(doc), len(mineru_data))
+
+        enriched_data = None
+        if page_count >= PARALLEL_MIN_PAGES and max_workers > 1:
+            try:
+                enriched_data = self._process_pages_in_pool(pdf_path, mineru_data, page_count, max_workers)
+            except (BrokenProcessPool, pickle.PicklingError) as e:
+                print(f"⚠️ Traitement parallèle indisponible ({e}), traitement séquentiel")
+
+        if enriched_data is None:
+            enriched_data = []
+            for page_num in range(page_count):
+                print(f"  Page {page_num}...")
+                enriched_data.append(self._process_page(doc.load_page(page_num), page_num, mineru_data[page_num]))
+
+        if owns_doc:
+            doc.close()
+        return enriched_data
+
+    def _process_pages_in_pool(self, pdf_path: str, mineru_data: List, page_count: int, max_workers: int) -> List:
+        """Traiter les pages dans un pool de processus ; résultats dans l'ordre des pages"""
+        workers = min(max_workers, page_count)
+        tasks = [(page_num, mineru_data[page_num]) for page_num in range(page_count)]
         enriched_data = []
 
-        for page_num in range(len(doc)):
-            if page_num >= len(mineru_data):
-                break
-            print(f"  Page {page_num}...")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_page_worker,
+                                 initargs=(self, pdf_path)) as pool:
+            chunksize = max(1, page_count // (workers * 4))
+            for page_num, dims, text_bboxes, enriched_page in pool.map(_process_page_worker, tasks, chunksize=chunksize):
+                print(f"  Page {page_num}...")
+                self.page_dimensions[page_num] = dims
+                self.style_counters[page_num] = {}
+                self._text_bboxes_by_page[page_num] = text_bboxes
+                self._reintern_page(enriched_page)
+                enriched_data.append(enriched_page)
 
-            page = doc.load_page(page_num)
-            page_rect = page.rect
+        return enriched_data
 
-            # Stocker les dimensions de page
-            self.page_dimensions[page_num] = [page_rect.width, page_rect.height]
+    def _reintern_page(self, enriched_page: List[Dict]) -> None:
+        """
+        Rétablir le partage des styles et polices d'une page revenue du pool.
 
-            # Extraire spans PyMuPDF
-            pymupdf_spans = self._extract_pymupdf_spans_detailed(page, page_rect)
+        Le passage par pickle donne à chaque page ses propres copies : les styles
+        reprennent leur dict canonique (_intern_style) et les noms de police et
+        balises sont de nouveau internalisés.
+        """
+        def canonical(style):
+            return self._intern_style(style['police'], style['taille'], style['couleur'])
+
+        for block in enriched_page:
+            if block.get('default_style'):
+                block['default_style'] = canonical(block['default_style'])
+            additional_styles = block.get('additional_styles')
+            if additional_styles:
+                block['additional_styles'] = {
+                    sys.intern(tag): canonical(style) for tag, style in additional_styles.items()
+                }
+            list_marker = block.get('list_marker')
+            if list_marker:
+                list_marker['style'] = canonical(list_marker['style'])
+            for span in block.get('matching_spans', []):
+                span['font_name'] = sys.intern(span['font_name'])
+
+    def _process_page(self, page, page_num: int, page_data) -> List[Dict]:
+        """Extraire les spans d'une page PyMuPDF et enrichir ses blocs MinerU"""
+        page_rect = page.rect
 
-            # Traiter les blocs MinerU de cette page
-            page_data = mineru_data[page_num]
-            enriched_page = self._enrich_page_blocks(page_data, pymupdf_spans, page_num)
+        # Stocker les dimensions de page
+        self.page_dimensions[page_num] = [page_rect.width, page_rect.height]
 
-            enriched_data.append(enriched_page)
+        # Extraire spans PyMuPDF
+        pymupdf_spans = self._extract_pymupdf_spans_detailed(page, page_rect)
+        self._text_bboxes_by_page[page_num] = [s['bbox_pixels'] for s in pymupdf_spans]
 
-        doc.close()
-        return enriched_data
+        # Traiter les blocs MinerU de cette page
+        return self._enrich_page_blocks(page_data, pymupdf_spans, page_num)
 
     def _extract_pymupdf_spans_detailed(self, page, page_rect):
         """Extraire spans PyMuPDF avec détails complets"""
 
         text_dict = page.get_text("dict")
+
+        # Spans non vides, dans l'ordre de lecture PyMuPDF
+        raw_spans = [
+            span
+            for block in text_dict["blocks"] if "lines" in block
+            for line in block["lines"]
+            for span in line["spans"]
+            if span["text"].strip()
+        ]
+        if not raw_spans:
+            return []
+
+        # Normalisation des bbox en une passe vectorisée
+        bboxes = np.array([span["bbox"] for span in raw_spans], dtype=np.float64)
+        scale = np.array([page_rect.width, page_rect.height, page_rect.width, page_rect.height])
+        bboxes_norm = (bboxes / scale).tolist()
+
+        # Gras / italique / exposant restent encodés dans 'flags' (cf. _span_flag)
         spans = []
-        span_id = 0
-
-        for block_idx, block in enumerate(text_dict["blocks"]):
-            if "lines" in block:
-                for line_idx, line in enumerate(block["lines"]):
-                    for span_idx, span in enumerate(line["spans"]):
-                        if span["text"].strip():
-                            # Coordonnées normalisées ET pixels
-                            bbox_norm = [
-                                span["bbox"][0] / page_rect.width,
-                                span["bbox"][1] / page_rect.height,
-                                span["bbox"][2] / page_rect.width,
-                                span["bbox"][3] / page_rect.height
-                            ]
-
-                            span_info = {
-                                'id': span_id,
-                                'text': span["text"],
-                                'bbox_pixels': span["bbox"],
-                                'bbox_normalized': bbox_norm,
-                                'font_name': span["font"],
-                                'font_size': round(span["size"], 2),
-                                'color_rgb': span["color"],
-                                'color_hex': f"#{span['color']:06x}",
-                                'flags': span["flags"],
-                                'is_bold': bool(span["flags"] & 2**4),
-                                'is_italic': bool(span["flags"] & 2**1),
-                                'is_superscript': bool(span["flags"] & 2**0),
-                                'matched_to_block': None,
-                                'match_quality': 'unmatched'
-                            }
-                            spans.append(span_info)
-                            span_id += 1
+        for span_id, span in enumerate(raw_spans):
+            spans.append({
+                'id': span_id,
+                'text': span["text"],
+                'bbox_pixels': span["bbox"],
+                'bbox_normalized': bboxes_norm[span_id],
+                'font_name': sys.intern(span["font"]),  # quelques polices pour des milliers de spans
+                'font_size': round(span["size"], 2),
+                'color_rgb': span["color"],
+                'flags': span["flags"],
+                'matched_to_block': None,
+                'match_quality': 'unmatched'
+            })
 
         return spans
 
@@ -300,16 +649,26 @@ class DualOutputGenerator:
                     content = block.get('content', '')
                     
                     if bbox and len(bbox) == 4:
+                        # Conservé tel quel dans 'mineru_original' : pas de copie du bloc brut,
+                        # dont seuls type, contenu et bbox sont relus
                         standardized_blocks.append({
                             'type': block_type,
                             'content': content,
                             'bbox': bbox,  # Déjà normalisé (0-1)
-                            'original_block': block
                         })
         
-        # Trier par position (haut vers bas, gauche vers droite)
-        standardized_blocks.sort(key=lambda b: (b['bbox'][1], b['bbox'][0]))
+        # Trier par position (haut vers bas, gauche vers droite) ; tri stable dans les deux cas
+        if len(standardized_blocks) > NUMPY_SORT_THRESHOLD:
+            bboxes = np.array([b['bbox'] for b in standardized_blocks], dtype=np.float64)
+            order = np.lexsort((bboxes[:, 0], bboxes[:, 1]))
+            standardized_blocks = [standardized_blocks[i] for i in order.tolist()]
+        else:
+            standardized_blocks.sort(key=lambda b: (b['bbox'][1], b['bbox'][0]))
         
+        # Index des spans et dimensions, partagés par tous les blocs de la page
+        span_index = SpanIndex(pymupdf_spans)
+        page_dims = self.page_dimensions[page_num]
+
         # Enrichir avec matching PyMuPDF
         enriched_blocks = []
         group_counter = 0
@@ -320,11 +679,11 @@ class DualOutputGenerator:
         for block_idx, block in enumerate(standardized_blocks):
             if block.get('type') in ['text', 'title']:
                 matching_spans = self._find_matching_spans_for_block(
-                    block, pymupdf_spans, page_num
+                    block, pymupdf_spans, page_num, span_index
                 )
                 
                 enriched_block = self._create_enriched_block(
-                    block, matching_spans, page_num, group_counter, bloc_counter
+                    block, matching_spans, page_num, group_counter, bloc_counter, page_dims
                 )
                 self.update_empty_block_style_from_first_span(enriched_block)
                 enriched_blocks.append(enriched_block)
@@ -335,11 +694,11 @@ class DualOutputGenerator:
                     span['matched_to_block'] = block_idx
         
         # Ajouter les spans isolés
-        isolated_spans = [s for s in pymupdf_spans if s['matched_to_block'] is None]
+        isolated_spans = [pymupdf_spans[i] for i in span_index.unmatched()]
         
         for span in isolated_spans:
             isolated_block = self._create_isolated_span_block(
-                span, page_num, group_counter, bloc_counter
+                span, page_num, group_counter, bloc_counter, page_dims
             )
             enriched_blocks.append(isolated_block)
             bloc_counter += 1
@@ -348,52 +707,57 @@ class DualOutputGenerator:
 
 
 
-    def _find_matching_spans_for_block(self, block: Dict, pymupdf_spans: List, page_num: int):
-        """Trouver les spans PyMuPDF correspondant à un bloc MinerU."""
+    def _find_matching_spans_for_block(self, block: Dict, pymupdf_spans: List, page_num: int, span_index: SpanIndex = None):
+        """
+        Trouver les spans PyMuPDF correspondant à un bloc MinerU.
+
+        Si span_index est fourni, la sélection géométrique s'y fait en bloc et
+        les spans retenus y sont marqués comme attribués.
+        """
 
         block_bbox = block['bbox']
         block_content = block.get('content', '').lower()
+        # Mots du bloc calculés une seule fois pour tous les spans candidats
+        block_words = frozenset(word for word in block_content.split() if len(word) >= 2)
         matching_spans = []
 
+        if span_index is not None:
+            candidate_indices = span_index.candidates(block_bbox, self.bbox_tolerance)
+        else:
+            bboxes = np.array([s['bbox_normalized'] for s in pymupdf_spans], dtype=np.float64).reshape(-1, 4)
+            candidate_indices = np.flatnonzero(_overlap_mask(bboxes, block_bbox, self.bbox_tolerance)).tolist()
+        matched_indices = []
+
         # 1. Sélection initiale par chevauchement de bbox + score texte
-        for span in pymupdf_spans:
+        for i in candidate_indices:
+            span = pymupdf_spans[i]
             if span['matched_to_block'] is not None:
                 continue
 
-            if self._spans_overlap(span['bbox_normalized'], block_bbox):
-                if not block_content.strip():
-                    text_match_score = 1.0
-                else:
-                    text_match_score = self._evaluate_text_match(span['text'], block_content)
+            if not block_content.strip():
+                text_match_score = 1.0
+            else:
+                text_match_score = self._evaluate_text_match(span['text'], block_content, block_words)
 
-                if text_match_score > 0:
-                    span['text_match_score'] = text_match_score
-                    span['match_quality'] = self._get_match_quality_label(text_match_score)
-                    matching_spans.append(span)
+            if text_match_score > 0:
+                span['text_match_score'] = text_match_score
+                span['match_quality'] = self._get_match_quality_label(text_match_score)
+                matching_spans.append(span)
+                matched_indices.append(i)
 
         if not matching_spans:
             return []
 
+        if span_index is not None:
+            span_index.mark_matched(matched_indices)
+
         # 2. Regrouper les spans par lignes (tolérance verticale) puis trier par X
 
         y_tolerance = 1.0  # en pixels
-        lines = defaultdict(list)
-
-        for span in matching_spans:
-            y_span = span['bbox_pixels'][1]
-            line_y = None
-            for existing_y in lines.keys():
-                if abs(y_span - existing_y) <= y_tolerance:
-                    line_y = existing_y
-                    break
-            if line_y is None:
-                line_y = y_span
-            lines[line_y].append(span)
 
         sorted_spans = []
-        for y in sorted(lines.keys()):
-            line_spans = sorted(lines[y], key=lambda s: s['bbox_pixels'][0])
-            sorted_spans.extend(line_spans)
+        for _, line_spans in self._group_spans_by_line(matching_spans, y_tolerance):
+            sorted_spans.extend(sorted(line_spans, key=lambda s: s['bbox_pixels'][0]))
 
         return sorted_spans
 
@@ -408,8 +772,13 @@ class DualOutputGenerator:
                 span_bbox[2] <= block_bbox[2] + tolerance and
                 span_bbox[3] <= block_bbox[3] + tolerance)
 
-    def _evaluate_text_match(self, span_text: str, block_content: str) -> float:
-        """Évaluer la correspondance textuelle"""
+    def _evaluate_text_match(self, span_text: str, block_content: str, block_words: frozenset = None) -> float:
+        """
+        Évaluer la correspondance textuelle
+
+        Args:
+            block_words: Mots (>= 2 caractères) de block_content, précalculés par l'appelant
+        """
 
         span_text = span_text.strip().lower()
 
@@ -421,7 +790,8 @@ class DualOutputGenerator:
 
         # Correspondance par mots
         span_words = set(word for word in span_text.split() if len(word) >= 2)
-        block_words = set(word for word in block_content.split() if len(word) >= 2)
+        if block_words is None:
+            block_words = set(word for word in block_content.split() if len(word) >= 2)
 
         if span_words and block_words:
             common_words = span_words & block_words
@@ -436,7 +806,7 @@ class DualOutputGenerator:
         elif quality >= 0.4: return 'fair'
         else: return 'poor'
 
-    def _create_enriched_block(self, mineru_block: Dict, matching_spans: List, page_num: int, group_num: int, bloc_num: int):
+    def _create_enriched_block(self, mineru_block: Dict, matching_spans: List, page_num: int, group_num: int, bloc_num: int, page_dims: List = None):
         block_id = f"page{page_num+1}_group{group_num}_bloc{bloc_num:02d}"
         mineru_content = mineru_block.get('content', '')
         
@@ -447,25 +817,23 @@ class DualOutputGenerator:
         
         block_type = self._determine_block_type(content, mineru_block)
         
-        page_dims = self.page_dimensions[page_num]
-        position_xy = [
-            mineru_block['bbox'][0] * page_dims[0],
-            mineru_block['bbox'][1] * page_dims[1]
-        ]
-        max_width = (mineru_block['bbox'][2] - mineru_block['bbox'][0]) * page_dims[0]
+        page_w, page_h = page_dims or self.page_dimensions[page_num]
+        x0, y0, x1, _ = mineru_block['bbox']
+        position_xy = [x0 * page_w, y0 * page_h]
+        max_width = (x1 - x0) * page_w
         
         styled_content, additional_styles = self._create_styled_content(content, matching_spans, page_num)
         
         # DEFAULT_STYLE = PREMIER SPAN ou Unknown (sera corrigé après)
         if matching_spans and matching_spans[0].get('font_name'):
             first_span = matching_spans[0]
-            default_style = {
-                'police': first_span.get('font_name'),
-                'taille': first_span.get('font_size', 12.0),
-                'couleur': first_span.get('color_rgb', 0)
-            }
+            default_style = self._intern_style(
+                first_span.get('font_name'),
+                first_span.get('font_size', 12.0),
+                first_span.get('color_rgb', 0)
+            )
         else:
-            default_style = {'police': 'Unknown', 'taille': 12.0, 'couleur': 0}
+            default_style = self._intern_style('Unknown', 12.0, 0)
         
         enriched_block = {
             'id': block_id,
@@ -498,8 +866,8 @@ class DualOutputGenerator:
             return 'title'
 
         if (content.strip().startswith('•') or 
-            re.match(r'^\s*[\-\*]\s', content) or
-            re.match(r'^\s*\d+\.\s', content)):
+            _LIST_DASH_RE.match(content) or
+            _LIST_NUM_RE.match(content)):
             return 'list_item'
 
         if content.isupper() and len(content.split()) < 10:
@@ -512,28 +880,21 @@ class DualOutputGenerator:
         if not matching_spans:
             return content, {}
         
-        span_styles = []
+        # Style dominant : clé de style et fréquence calculées en un seul passage
+        styled_spans = []
+        style_freq = defaultdict(int)
         for s in matching_spans:
-            if s.get('text'):
-                span_styles.append({
-                    'font': s.get('font_name'),
-                    'size': s.get('font_size'),
-                    'color': s.get('color_rgb'),
-                    'is_bold': s.get('is_bold'),
-                    'is_italic': s.get('is_italic'),
-                    'text': s.get('text')
-                })
-        
-        if not span_styles:
+            text = s.get('text')
+            if text:
+                style_key = (s.get('font_name'), s.get('font_size'), s.get('color_rgb'),
+                             _span_flag(s, _FLAG_BOLD), _span_flag(s, _FLAG_ITALIC))
+                styled_spans.append((style_key, text))
+                style_freq[style_key] += len(text)
+        
+        if not styled_spans:
             return content, {}
         
-        # Style dominant
-        from collections import defaultdict
-        style_freq = defaultdict(int)
-        for s in span_styles:
-            style_key = (s['font'], s['size'], s['color'], s['is_bold'], s['is_italic'])
-            style_freq[style_key] += len(s['text'])
-        
+        # Premier style rencontré en cas d'égalité
         dominant_style_key = max(style_freq, key=style_freq.get)
         
         # Créer styled_content
@@ -541,23 +902,17 @@ class DualOutputGenerator:
         additional_styles = {}
         style_counter = 1
         
-        for span in span_styles:
-            current_style_key = (span['font'], span['size'], span['color'], span['is_bold'], span['is_italic'])
-            if current_style_key == dominant_style_key:
-                styled_parts.append(span['text'])
+        for style_key, text in styled_spans:
+            if style_key == dominant_style_key:
+                styled_parts.append(text)
             else:
-                style_tag = f"s{style_counter}"
-                additional_styles[style_tag] = {
-                    'police': span['font'],
-                    'taille': span['size'],
-                    'couleur': span['color']
-                }
-                styled_parts.append(f"{style_tag}{span['text']}{style_tag}")
+                style_tag = sys.intern(f"s{style_counter}")
+                additional_styles[style_tag] = self._intern_style(style_key[0], style_key[1], style_key[2])
+                styled_parts.append(f"{style_tag}{text}{style_tag}")
                 style_counter += 1
         
         styled_content = "".join(styled_parts)
-        import re
-        styled_content = re.sub(r'\s+', ' ', styled_content.replace('\n', ' ').replace('\t', ' '))
+        styled_content = _collapse_whitespace(styled_content)
         
         return styled_content, additional_styles
 
@@ -568,19 +923,18 @@ class DualOutputGenerator:
         """Créer les informations de marqueur de liste"""
 
         if not matching_spans:
-            return {"text": "•", "style": {"police": "Unknown", "taille": 12.0, "couleur": 0}, "text_indent": 15.0}
+            return {"text": "•", "style": self._intern_style("Unknown", 12.0, 0), "text_indent": 15.0}
 
         first_span = matching_spans[0]
         return {
             "text": "•",
-            "style": {"police": first_span['font_name'], "taille": first_span['font_size'], "couleur": first_span['color_rgb']},
+            "style": self._intern_style(first_span['font_name'], first_span['font_size'], first_span['color_rgb']),
             "text_indent": 15.0
         }
 
     def _detect_svgs_in_content(self, content: str):
         """Détecter les références SVG dans le contenu"""
-        svg_pattern = r'<svg\s+id="([^"]+)"/>'
-        svgs = re.findall(svg_pattern, content)
+        svgs = _SVG_RE.findall(content)
         if not svgs: return None
 
         svg_info = {}
@@ -591,15 +945,16 @@ class DualOutputGenerator:
             }
         return svg_info
 
-    def _create_isolated_span_block(self, span: Dict, page_num: int, group_num: int, bloc_num: int):
+    def _create_isolated_span_block(self, span: Dict, page_num: int, group_num: int, bloc_num: int, page_dims: List = None):
         """Créer un bloc pour un span isolé"""
 
         block_id = f"page{page_num+1}_isolated_pymupdf_{span['id']}"
-        page_dims = self.page_dimensions[page_num]
-        position_xy = [span['bbox_normalized'][0] * page_dims[0], span['bbox_normalized'][1] * page_dims[1]]
-        width = (span['bbox_normalized'][2] - span['bbox_normalized'][0]) * page_dims[0]
+        page_w, page_h = page_dims or self.page_dimensions[page_num]
+        x0, y0, x1, _ = span['bbox_normalized']
+        position_xy = [x0 * page_w, y0 * page_h]
+        width = (x1 - x0) * page_w
 
-        default_style = {"police": span['font_name'], "taille": span['font_size'], "couleur": span['color_rgb']}
+        default_style = self._intern_style(span['font_name'], span['font_size'], span['color_rgb'])
 
         return {
             'id': block_id, 'content': span['text'], 'styled_content': span['text'],
@@ -626,8 +981,6 @@ class DualOutputGenerator:
         current_y = None
         y_tolerance = 2.0  # Tolérance en pixels pour considérer que deux spans sont sur la même ligne
 
-        page_dims = self.page_dimensions.get(page_num, {})
-
         for span in matching_spans:
             # Position Y en pixels
             span_y = span['bbox_pixels'][1]  # top Y
@@ -649,7 +1002,7 @@ class DualOutputGenerator:
         return max(1, len(lines))
 
 
-    def create_clean_template(self, pdf_path: str, output_template: str, enriched_data: List[List[Dict[str, Any]]] = None):
+    def create_clean_template(self, pdf_path: str, output_template: str, enriched_data: List[List[Dict[str, Any]]] = None, doc: fitz.Document = None):
         """
         Crée un template PDF sans texte
         
@@ -658,14 +1011,17 @@ class DualOutputGenerator:
             output_template: Chemin vers le template de sortie
             enriched_data: Données enrichies pour identifier les spans à exclure
                           Si None, tous les spans sont supprimés (comportement par défaut)
+            doc: Document déjà ouvert sur pdf_path, non encore modifié. Les
+                 suppressions y sont appliquées ; il reste à fermer par l'appelant.
         """
         print(f"\n🧹 Création du template: {output_template}")
         
-        # Collecter les bounding boxes des spans à CONSERVER
-        excluded_bboxes = set()
+        # Collecter les bounding boxes des spans à CONSERVER (clés entières, par page)
+        excluded_by_page: Dict[int, frozenset] = {}
         
         if enriched_data:
             for page_num, page_blocks in enumerate(enriched_data):
+                page_keys = set()
                 for block in page_blocks:
                     # ✅ Garder les spans exclus des blocs normaux
                     if not block.get('include_in_output', True) and block.get('block_type') != 'isolated_span':
@@ -673,8 +1029,7 @@ class DualOutputGenerator:
                         for span in matching_spans:
                             bbox_px = span.get('bbox_pixels')
                             if bbox_px:
-                                bbox_key = (page_num, tuple(bbox_px))
-                                excluded_bboxes.add(bbox_key)
+                                page_keys.add(_quantize_bbox(bbox_px))
                     
                     # ✅ NOUVEAU : Garder les isolated_span exclus (mais pas consumed)
                     if block.get('block_type') == 'isolated_span':
@@ -683,44 +1038,57 @@ class DualOutputGenerator:
                             for span in matching_spans:
                                 bbox_px = span.get('bbox_pixels')
                                 if bbox_px:
-                                    bbox_key = (page_num, tuple(bbox_px))
-                                    excluded_bboxes.add(bbox_key)
+                                    page_keys.add(_quantize_bbox(bbox_px))
+                if page_keys:
+                    excluded_by_page[page_num] = frozenset(page_keys)
             
-            print(f"   📌 {len(excluded_bboxes)} spans exclus seront conservés dans le template")
+            excluded_count = sum(len(keys) for keys in excluded_by_page.values())
+            print(f"   📌 {excluded_count} spans exclus seront conservés dans le template")
         
-        doc = fitz.open(pdf_path)
+        owns_doc = doc is None
+        if owns_doc:
+            doc = fitz.open(pdf_path)
+
+        # bbox déjà relevées lors du matching de ce même PDF : pas de second get_text
+        cached_bboxes = self._text_bboxes_by_page if self._text_bboxes_source == pdf_path else {}
         
         for page_num in range(len(doc)):
             page = doc[page_num]
             print(f"   Page {page_num + 1}: Suppression du texte...")
             
             try:
-                text_dict = page.get_text("dict")
+                span_bboxes = cached_bboxes.get(page_num)
+                if span_bboxes is None:
+                    text_dict = page.get_text("dict")
+                    span_bboxes = [
+                        span["bbox"]
+                        for block in text_dict["blocks"] if block.get("type") == 0
+                        for line in block.get("lines", [])
+                        for span in line.get("spans", [])
+                        if span.get("text", "").strip()
+                    ]
+                excluded_keys = excluded_by_page.get(page_num, frozenset())
                 text_instances = []
+                kept_rects = []
                 kept_count = 0
                 removed_count = 0
                 
-                for block in text_dict["blocks"]:
-                    if block.get("type") == 0:
-                        for line in block.get("lines", []):
-                            for span in line.get("spans", []):
-                                if span.get("text", "").strip():
-                                    span_bbox = span["bbox"]
-                                    bbox_key = (page_num, tuple(span_bbox))
-                                    
-                                    # Vérifier si ce span doit être conservé
-                                    if bbox_key in excluded_bboxes:
-                                        kept_count += 1
-                                        # Ne pas ajouter à text_instances = ne pas supprimer
-                                    else:
-                                        removed_count += 1
-                                        text_instances.append({'bbox': fitz.Rect(span_bbox)})
+                for span_bbox in span_bboxes:
+                    # Vérifier si ce span doit être conservé
+                    if excluded_keys and _quantize_bbox(span_bbox) in excluded_keys:
+                        kept_count += 1
+                        kept_rects.append(fitz.Rect(span_bbox))
+                        # Ne pas ajouter à text_instances = ne pas supprimer
+                    else:
+                        removed_count += 1
+                        text_instances.append({'bbox': fitz.Rect(span_bbox)})
                 
-                # Appliquer les suppressions
-                for instance in text_instances:
-                    page.add_redact_annot(instance['bbox'])
+                # Appliquer les suppressions (spans contigus d'une même ligne regroupés)
+                redact_rects = self._merge_redaction_rects([instance['bbox'] for instance in text_instances], kept_rects)
+                for rect in redact_rects:
+                    page.add_redact_annot(rect)
                 
-                if text_instances:
+                if redact_rects:
                     page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE)
                 
                 if kept_count > 0:
@@ -732,14 +1100,53 @@ class DualOutputGenerator:
                 print(f"      ❌ Erreur: {e}")
         
         doc.save(output_template, garbage=4, deflate=True, clean=True)
-        doc.close()
+        if owns_doc:
+            doc.close()
         print(f"   ✅ Template créé")
 
 
 
 
-    def create_visual_diagnostic(self, pdf_path: str, enriched_data: List, base_name: str = None):
-        """Créer un PDF de diagnostic visuel basé sur l'enrichissement existant"""
+    def _merge_redaction_rects(self, rects: List, kept_rects: List = (), gap: float = 0.5, y_tolerance: float = 1.0) -> List:
+        """
+        Regrouper les rectangles qui se touchent sur une même ligne.
+
+        Seuls des rectangles de même bande verticale (y0 et y1 à y_tolerance
+        près) et adjacents (écart horizontal <= gap) sont réunis, et jamais si
+        l'union toucherait un span conservé : la zone supprimée reste celle
+        des spans d'origine.
+
+        Args:
+            rects: fitz.Rect des spans à supprimer
+            kept_rects: fitz.Rect des spans conservés sur la page
+            gap: Écart horizontal maximal, en points
+            y_tolerance: Écart maximal sur y0 et y1, en points
+
+        Returns:
+            Liste de fitz.Rect, au plus len(rects)
+        """
+        merged = []
+        for rect in sorted(rects, key=lambda r: (r.y0, r.x0)):
+            if merged:
+                last = merged[-1]
+                if (abs(rect.y0 - last.y0) <= y_tolerance and abs(rect.y1 - last.y1) <= y_tolerance and
+                        rect.x0 <= last.x1 + gap and rect.x1 >= last.x0 - gap):
+                    union = last | rect
+                    if not any(union.intersects(kept) for kept in kept_rects):
+                        merged[-1] = union
+                        continue
+            merged.append(fitz.Rect(rect))
+        return merged
+
+    def create_visual_diagnostic(self, pdf_path: str, enriched_data: List, base_name: str = None,
+                                 compress: bool = True):
+        """
+        Créer un PDF de diagnostic visuel basé sur l'enrichissement existant
+
+        Args:
+            compress: Compresser et nettoyer le PDF à l'enregistrement (mêmes options que
+                le template) ; False pour une écriture plus rapide d'un fichier plus gros
+        """
         if base_name is None:
             base_name = os.path.splitext(os.path.basename(pdf_path))[0]
 
@@ -758,12 +1165,12 @@ class DualOutputGenerator:
         }
 
         # Traiter chaque page
-        for page_num in range(len(doc)):
-            if page_num >= len(enriched_data):
+        page_count = len(doc)
+        for page_num, page_blocks in enumerate(enriched_data):
+            if page_num >= page_count:
                 break
 
-            page = doc.load_page(page_num)
-            page_blocks = enriched_data[page_num]
+            page = doc[page_num]
 
             # Dessiner le diagnostic sur cette page
             self._draw_diagnostic_on_page(page, page_blocks, global_stats, page_num)
@@ -772,7 +1179,10 @@ class DualOutputGenerator:
         self._add_diagnostic_summary_page(doc, global_stats)
 
         # Sauvegarder
-        doc.save(diagnostic_file)
+        if compress:
+            doc.save(diagnostic_file, garbage=4, deflate=True, clean=True)
+        else:
+            doc.save(diagnostic_file)
         doc.close()
 
         print(f"   ✅ Diagnostic créé: {diagnostic_file}")
@@ -783,22 +1193,37 @@ class DualOutputGenerator:
     def _draw_diagnostic_on_page(self, page, page_blocks: List, global_stats: Dict, page_num: int):
         """Dessiner les éléments de diagnostic sur une page"""
         page_rect = page.rect
+        page_width, page_height = page_rect.width, page_rect.height
 
-        for block_idx, block in enumerate(page_blocks):
-            if not block.get('block_type'):
-                continue
+        # Seuls les blocs typés sont dessinés ; leur index d'origine sert à la numérotation
+        typed_blocks = [(i, b) for i, b in enumerate(page_blocks) if b.get('block_type')]
+        if not typed_blocks:
+            return
+
+        # bbox MinerU de toute la page converties en pixels en une opération
+        mineru_indices = [i for i, b in typed_blocks if 'mineru_original' in b]
+        scale = np.array([page_width, page_height, page_width, page_height])
+        mineru_pixels = dict(zip(mineru_indices, (np.array(
+            [page_blocks[i]['mineru_original']['bbox'] for i in mineru_indices], dtype=np.float64
+        ).reshape(-1, 4) * scale).tolist()))
+
+        # Longueur de texte des spans, sommée par bloc
+        spans_text_lens = self._precompute_page_arrays([b for _, b in typed_blocks])['block_text_len']
+
+        # Un seul Shape pour toute la page : chaque page.draw_rect/insert_text
+        # crée et valide le sien (réécriture du flux de contenu à chaque appel).
+        # Les textes d'un Shape sont écrits après ses tracés : les numéros restent lisibles.
+        shape = page.new_shape()
+
+        # bbox des spans regroupées par couleur, tracées en un chemin par couleur
+        span_rects_by_color = defaultdict(list)
 
+        for (block_idx, block), spans_text_len in zip(typed_blocks, spans_text_lens):
             matching_spans = block.get('matching_spans', [])
 
             # Calculer la bbox en pixels
-            if 'mineru_original' in block:
-                mineru_bbox = block['mineru_original']['bbox']
-                bbox_pixels = [
-                    mineru_bbox[0] * page_rect.width,
-                    mineru_bbox[1] * page_rect.height,
-                    mineru_bbox[2] * page_rect.width,
-                    mineru_bbox[3] * page_rect.height
-                ]
+            if block_idx in mineru_pixels:
+                bbox_pixels = mineru_pixels[block_idx]
             else:
                 if matching_spans:
                     span = matching_spans[0]
@@ -813,7 +1238,6 @@ class DualOutputGenerator:
                 color, width = (1, 0.5, 0), 1.5
                 global_stats['empty_mineru_blocks'] += 1
             else:
-                spans_text_len = sum(len(s['text']) for s in matching_spans)
                 block_content_len = len(block.get('content', ''))
 
                 if block_content_len > 0:
@@ -831,7 +1255,8 @@ class DualOutputGenerator:
                     global_stats['partial_matches'] += 1
 
             # Dessiner le rectangle du bloc
-            page.draw_rect(bbox_rect, color=color, width=width)
+            shape.draw_rect(bbox_rect)
+            shape.finish(color=color, width=width)
 
             # Numéroter le bloc
             center_x = (bbox_rect.x0 + bbox_rect.x1) / 2
@@ -839,31 +1264,28 @@ class DualOutputGenerator:
             num_text = f"B{block_idx}"
 
             text_rect = fitz.Rect(center_x - 15, center_y - 8, center_x + 15, center_y + 8)
-            page.draw_rect(text_rect, color=(1, 1, 1), fill=(1, 1, 1), fill_opacity=0.8)
-            page.insert_text(fitz.Point(center_x - 10, center_y + 3), num_text, 
-                            fontsize=10, color=(0, 0, 0))
+            shape.draw_rect(text_rect)
+            shape.finish(color=(1, 1, 1), fill=(1, 1, 1), fill_opacity=0.8)
+            shape.insert_text(fitz.Point(center_x - 10, center_y + 3), num_text, 
+                              fontsize=10, color=(0, 0, 0))
 
-            # Dessiner les spans matchés
+            # Spans matchés, dessinés après la boucle
             for span in matching_spans:
-                span_bbox = fitz.Rect(span['bbox_pixels'])
-
-                quality = span.get('match_quality', 'unmatched')
-                if quality == 'excellent':
-                    span_color = (0, 0, 1)
-                elif quality == 'good':
-                    span_color = (0, 0.5, 1)
-                elif quality == 'fair':
-                    span_color = (0.5, 0.5, 1)
-                else:
-                    span_color = (0.8, 0.8, 1)
-
-                page.draw_rect(span_bbox, color=span_color, width=1.0)
-
-                global_stats['matched_spans'] += 1
+                span_color = _MATCH_QUALITY_COLORS.get(span.get('match_quality'), _UNMATCHED_SPAN_COLOR)
+                span_rects_by_color[span_color].append(span['bbox_pixels'])
 
+            global_stats['matched_spans'] += len(matching_spans)
             global_stats['total_mineru_blocks'] += 1
             global_stats['total_pymupdf_spans'] += len(matching_spans)
 
+        # Dessiner les spans matchés
+        for span_color, span_rects in span_rects_by_color.items():
+            for span_bbox in span_rects:
+                shape.draw_rect(span_bbox)
+            shape.finish(color=span_color, width=1.0)
+
+        shape.commit()
+
     def _add_diagnostic_summary_page(self, doc, stats: Dict):
         """Ajouter une page de résumé avec statistiques"""
         summary_page = doc.new_page(width=595, height=842)
@@ -908,176 +1330,165 @@ class DualOutputGenerator:
 
     def _generate_translation_format(self, enriched_data: list):
         """Génère le format pour traduction avec styles globaux."""
-        translation_data = []
         merged_groups = {}
-        processed_block_ids = set()
+        standalone_entries = []
+
+        # Utiliser le mapping déjà construit
+        style_mapping = self.block_additional_style_refs
 
-        # Étape 1: Identification des groupes fusionnés
         for page_blocks in enriched_data:
             for block in page_blocks:
-                if block.get('merge_group_id'):
-                    merge_group_id = block.get('merge_group_id')
-                    if merge_group_id not in merged_groups:
-                        merged_groups[merge_group_id] = []
-                    merged_groups[merge_group_id].append(block)
+                merge_group_id = block.get('merge_group_id')
+                if merge_group_id:
+                    merged_groups.setdefault(merge_group_id, []).append(block)
+                    continue
 
-        # Utiliser le mapping déjà construit
-        style_mapping = self.block_additional_style_refs
+                entry = self._build_translation_entry(block, style_mapping)
+                if entry:
+                    standalone_entries.append(entry)
+
+        # Groupes fusionnés en tête, puis blocs restants dans l'ordre du document
+        return self._build_merged_group_entries(merged_groups, style_mapping) + standalone_entries
+
+    def _build_merged_group_entries(self, merged_groups: Dict[str, List[Dict]], style_mapping: Dict) -> List[Dict]:
+        """
+        Construire les entrées de traduction des groupes fusionnés.
+
+        Args:
+            merged_groups: {merge_group_id: blocs du groupe, dans l'ordre du document}
+            style_mapping: {block_id: {tag_local: tag_global}}
+
+        Returns:
+            Liste des entrées {"id", "source", "target"}
+        """
+        translation_data = []
 
-        # Étape 2: Traitement des groupes fusionnés
         for group_id, blocks in merged_groups.items():
-            blocks_sorted = sorted(blocks, key=lambda b: b.get('merge_order', 0))
-            
-            # ... (logique de style de référence inchangée) ...
-            reference_default_style = blocks_sorted[0].get('default_style', {})
-            first_block_id = blocks_sorted[0].get('id')
-            
-            unified_style_mapping = {}
-            
-            # 1. Collecter additional_styles
-            for blk in blocks_sorted:
-                blk_id = blk.get('id')
-                if blk_id in style_mapping:
-                    for local_tag, global_tag in style_mapping[blk_id].items():
-                        style_info = blk.get('additional_styles', {}).get(local_tag)
-                        if style_info:
-                            style_key = (
-                                style_info.get('police'),
-                                style_info.get('taille'),
-                                style_info.get('couleur')
-                            )
-                            if style_key not in unified_style_mapping:
-                                unified_style_mapping[style_key] = global_tag
-            
-            # 2. Ajouter default_styles
-            reference_style_key = (
-                reference_default_style.get('police'),
-                reference_default_style.get('taille'),
-                reference_default_style.get('couleur')
-            )
-            
-            for blk in blocks_sorted:
-                blk_id = blk.get('id')
-                blk_default = blk.get('default_style', {})
-                blk_style_key = (
-                    blk_default.get('police'),
-                    blk_default.get('taille'),
-                    blk_default.get('couleur')
-                )
-                
-                if blk_style_key != reference_style_key and blk_style_key not in unified_style_mapping:
-                    for gs_tag, gs_style in self.global_styles.items():
-                        gs_key = (
-                            gs_style.get('police'),
-                            gs_style.get('taille'),
-                            gs_style.get('couleur')
-                        )
-                        if blk_style_key == gs_key:
-                            unified_style_mapping[blk_style_key] = gs_tag
-                            break
-            
-            # 3. Reconstruire le contenu stylé
-            merged_parts = []
-            for blk in blocks_sorted:
-                matching_spans = blk.get('matching_spans', [])
-                if matching_spans:
-                    styled_text = self._rebuild_styled_content_for_merged_group(
-                        matching_spans,
-                        reference_default_style,
-                        unified_style_mapping
-                    )
-                else:
-                    styled_text = blk.get('styled_content', blk.get('content', ''))
-                    blk_id = blk.get('id')
-                    if blk_id in style_mapping:
-                        for local_tag, global_tag in style_mapping[blk_id].items():
-                            styled_text = styled_text.replace(f"<{local_tag}>", f"<{global_tag}>")
-                            styled_text = styled_text.replace(f"</{local_tag}>", f"</{global_tag}>")
-                
-                merged_parts.append(styled_text)
-            
-            merged_text = " ".join(merged_parts)
-            
             # --- INTERVENTION OVERRIDE (GROUPES) ---
+            # Texte corrigé : inutile de reconstruire le contenu du groupe
             if group_id in self.translation_overrides:
                 # print(f"[OVERRIDE] Application de la correction pour le groupe {group_id}")
                 merged_text = self.translation_overrides[group_id]
+            else:
+                merged_text = self._build_merged_group_text(blocks, style_mapping)
             # ---------------------------------------
-            
-            if merged_text.strip():
-                translation_data.append({"id": group_id, "source": merged_text.strip(), "target": ""})
-            processed_block_ids.update(b.get('id') for b in blocks_sorted)
 
-        # Étape 3: Traitement des blocs restants
-        for page_blocks in enriched_data:
-            for block in page_blocks:
-                if block.get('id') in processed_block_ids:
-                    continue
+            merged_text = merged_text.strip()
+            if merged_text:
+                translation_data.append({"id": group_id, "source": merged_text, "target": ""})
 
-                block_type = block.get('block_type')
+        return translation_data
 
-                if block_type == 'isolated_span':
-                    block_id = block.get('id')
-                    is_consumed = block.get('is_consumed', False)
-                    include_output = block.get('include_in_output', False)
-                    
-                    if is_consumed or not include_output:
-                        continue
-                    
-                    has_consumed_spans = False
-                    for span in block.get('matching_spans', []):
-                        span_matched_block = span.get('matched_to_block')
-                        if span_matched_block and span_matched_block != block_id:
-                            has_consumed_spans = True
-                            break
-                    
-                    if has_consumed_spans:
-                        continue
-                    
-                    matching_spans = block.get('matching_spans', [])
-                    if matching_spans:
-                        content = self._rebuild_styled_content_from_spans(
-                            matching_spans,
-                            block.get('default_style', {}),
-                            block.get('additional_styles', {})
-                        )
-                    else:
-                        content = block.get('styled_content', block.get('content', ''))
-                    
-                    content = self._replace_local_styles_with_global(content, block_id, style_mapping)
-                    
-                    # --- INTERVENTION OVERRIDE (ISOLATED) ---
-                    if block_id in self.translation_overrides:
-                        content = self.translation_overrides[block_id]
-                    # ----------------------------------------
+    def _build_merged_group_text(self, blocks: List[Dict], style_mapping: Dict) -> str:
+        """
+        Reconstruire le texte stylé d'un groupe fusionné, membres joints par un espace.
 
-                    if content.strip():
-                        translation_data.append({"id": block_id, "source": content.strip(), "target": ""})
-                
-                elif block_type != 'isolated_span':
-                    matching_spans = block.get('matching_spans', [])
-                    block_id = block.get('id')
-                    
-                    if matching_spans:
-                        source_text = self._rebuild_styled_content_from_spans(
-                            matching_spans,
-                            block.get('default_style', {}),
-                            block.get('additional_styles', {})
-                        )
-                    else:
-                        source_text = block.get('styled_content', block.get('content', ''))
-                    
-                    source_text = self._replace_local_styles_with_global(source_text, block_id, style_mapping)
-                    
-                    # --- INTERVENTION OVERRIDE (STANDARD) ---
-                    if block_id in self.translation_overrides:
-                        source_text = self.translation_overrides[block_id]
-                    # ----------------------------------------
-                    
-                    if source_text.strip() and block.get('include_in_output', True):
-                        translation_data.append({"id": block_id, "source": source_text.strip(), "target": ""})
+        Args:
+            blocks: Blocs du groupe, dans l'ordre du document
+            style_mapping: {block_id: {tag_local: tag_global}}
 
-        return translation_data
+        Returns:
+            Texte du groupe avec balises globales (<gs1>, ...)
+        """
+        blocks_sorted = sorted(blocks, key=lambda b: b.get('merge_order', 0))
+
+        # ... (logique de style de référence inchangée) ...
+        reference_default_style = blocks_sorted[0].get('default_style', {})
+
+        unified_style_mapping = {}
+
+        # 1. Collecter additional_styles
+        for blk in blocks_sorted:
+            blk_id = blk.get('id')
+            if blk_id in style_mapping:
+                for local_tag, global_tag in style_mapping[blk_id].items():
+                    style_info = blk.get('additional_styles', {}).get(local_tag)
+                    if style_info:
+                        style_key = _style_key(style_info)
+                        if style_key not in unified_style_mapping:
+                            unified_style_mapping[style_key] = global_tag
+
+        # 2. Ajouter default_styles
+        reference_style_key = _style_key(reference_default_style)
+
+        for blk in blocks_sorted:
+            blk_id = blk.get('id')
+            blk_style_key = _style_key(blk.get('default_style', {}))
+
+            if blk_style_key != reference_style_key and blk_style_key not in unified_style_mapping:
+                gs_tag = self._global_styles_by_key.get(blk_style_key)
+                if gs_tag:
+                    unified_style_mapping[blk_style_key] = gs_tag
+
+        # 3. Reconstruire le contenu stylé
+        def member_text(blk):
+            matching_spans = blk.get('matching_spans', [])
+            if matching_spans:
+                return self._rebuild_styled_content_for_merged_group(
+                    matching_spans,
+                    reference_default_style,
+                    unified_style_mapping
+                )
+            return self._replace_local_styles_with_global(
+                blk.get('styled_content', blk.get('content', '')),
+                blk.get('id'),
+                style_mapping
+            )
+
+        # Groupe d'un seul bloc : pas de liste intermédiaire
+        if len(blocks_sorted) == 1:
+            return member_text(blocks_sorted[0])
+
+        return " ".join([member_text(blk) for blk in blocks_sorted])
+
+    def _build_translation_entry(self, block: Dict, style_mapping: Dict):
+        """
+        Construire l'entrée de traduction d'un bloc hors groupe fusionné.
+
+        Returns:
+            {"id", "source", "target"}, ou None si le bloc ne produit rien
+        """
+        block_id = block.get('id')
+        matching_spans = block.get('matching_spans', [])
+
+        if block.get('block_type') == 'isolated_span':
+            is_consumed = block.get('is_consumed', False)
+            include_output = block.get('include_in_output', False)
+
+            if is_consumed or not include_output:
+                return None
+
+            for span in matching_spans:
+                span_matched_block = span.get('matched_to_block')
+                if span_matched_block and span_matched_block != block_id:
+                    return None
+        else:
+            # Bloc exclu : inutile de reconstruire son texte
+            if not block.get('include_in_output', True):
+                return None
+
+        # --- INTERVENTION OVERRIDE (ISOLATED / STANDARD) ---
+        # Texte corrigé : inutile de reconstruire le contenu du bloc
+        if block_id in self.translation_overrides:
+            source_text = self.translation_overrides[block_id]
+        else:
+            if matching_spans:
+                source_text = self._rebuild_styled_content_from_spans(
+                    matching_spans,
+                    block.get('default_style', {}),
+                    block.get('additional_styles', {})
+                )
+            else:
+                source_text = block.get('styled_content', block.get('content', ''))
+
+            source_text = self._replace_local_styles_with_global(source_text, block_id, style_mapping)
+        # ---------------------------------------------------
+
+        source_text = source_text.strip()
+        if source_text:
+            return {"id": block_id, "source": source_text, "target": ""}
+
+        return None
 
 
     def _rebuild_styled_content_for_merged_group(
@@ -1101,11 +1512,7 @@ class DualOutputGenerator:
         if not matching_spans:
             return ""
         
-        reference_style_key = (
-            reference_default_style.get('police'),
-            reference_default_style.get('taille'),
-            reference_default_style.get('couleur')
-        )
+        reference_style_key = _style_key(reference_default_style)
         
         styled_parts = []
         
@@ -1115,11 +1522,7 @@ class DualOutputGenerator:
             if not span_text:
                 continue
             
-            span_style_key = (
-                span.get('font_name'),
-                span.get('font_size'),
-                span.get('color_rgb')
-            )
+            span_style_key = _span_style_key(span)
             
             # Comparer avec le style de référence du groupe
             if span_style_key == reference_style_key:
@@ -1139,7 +1542,7 @@ class DualOutputGenerator:
         styled_content = "".join(styled_parts)
         
         # Nettoyer les espaces
-        styled_content = re.sub(r'\s+', ' ', styled_content).replace(' </', '</').replace('> <', '><')
+        styled_content = _tidy_styled_content(styled_content)
         
         return styled_content
 
@@ -1156,40 +1559,47 @@ class DualOutputGenerator:
         Returns:
             Tag du style global (ex: 'gs1', 'gs2', etc.)
         """
-        style_key = (
-            style_info.get('police'),
-            style_info.get('taille'),
-            style_info.get('couleur')
-        )
-        
         # Chercher si ce style existe déjà
-        for gs_tag, gs_style in self.global_styles.items():
-            gs_key = (
-                gs_style.get('police'),
-                gs_style.get('taille'),
-                gs_style.get('couleur')
-            )
-            if style_key == gs_key:
-                return gs_tag
+        gs_tag = self._global_styles_by_key.get(_style_key(style_info))
+        if gs_tag:
+            return gs_tag
         
         # Créer un nouveau style global
-        existing_nums = []
-        for tag in self.global_styles.keys():
-            if tag.startswith('gs') and tag[2:].isdigit():
-                existing_nums.append(int(tag[2:]))
-        
-        next_num = max(existing_nums) + 1 if existing_nums else 1
-        new_tag = f"gs{next_num}"
-        
-        # Ajouter aux styles globaux
-        self.global_styles[new_tag] = {
+        return self._add_global_style({
             'police': style_info.get('police'),
             'taille': style_info.get('taille'),
             'couleur': style_info.get('couleur')
-        }
+        })
+
+    def _add_global_style(self, style: Dict) -> str:
+        """
+        Ajoute un style global sous le prochain tag gsN libre et met à jour l'index inverse.
+        
+        Returns:
+            Tag du nouveau style global
+        """
+        # Tag internalisé : réutilisé comme clé dans tous les mappings de style
+        new_tag = sys.intern(f"gs{self._global_styles_next_num}")
+        self._global_styles_next_num += 1
+        
+        self.global_styles[new_tag] = style
+        self._global_styles_by_key.setdefault(_style_key(style), new_tag)
         
         return new_tag
 
+    def _reindex_global_styles(self):
+        """Reconstruit l'index inverse et le compteur gsN depuis self.global_styles (styles chargés)"""
+        self._global_styles_by_key = {}
+        max_num = 0
+        
+        for gs_tag, gs_style in self.global_styles.items():
+            # Premier tag retenu en cas de doublon, comme une recherche linéaire
+            self._global_styles_by_key.setdefault(_style_key(gs_style), gs_tag)
+            if gs_tag.startswith('gs') and gs_tag[2:].isdigit():
+                max_num = max(max_num, int(gs_tag[2:]))
+        
+        self._global_styles_next_num = max_num + 1
+
 
 
 
@@ -1209,73 +1619,49 @@ class DualOutputGenerator:
         if not matching_spans:
             return ""
         
-        # Créer une liste de styles pour chaque span
-        span_styles = []
-        for s in matching_spans:
-            # ✅ CORRECTION : Ignorer les spans sans texte
-            if not s.get('text'):
-                continue
-            span_styles.append({
-                'font': s.get('font_name'),
-                'size': s.get('font_size'),
-                'color': s.get('color_rgb'),
-                'is_bold': s.get('is_bold'),
-                'is_italic': s.get('is_italic'),
-                'text': s.get('text')
-            })
+        default_style_key = _style_key(default_style)
         
-        if not span_styles:
-            return ""
-        
-        # Déterminer le style dominant (celui avec le plus de caractères)
-        style_freq = {}
-        for s in span_styles:
-            style_key = (s['font'], s['size'], s['color'], s['is_bold'], s['is_italic'])
-            style_freq[style_key] = style_freq.get(style_key, 0) + len(s['text'])
-        
-        dominant_style_key = max(style_freq, key=style_freq.get)
-        
-        # Définir le style dominant attendu depuis default_style
-        default_style_key = (
-            default_style.get('police'),
-            default_style.get('taille'),
-            default_style.get('couleur'),
-            False,  # is_bold
-            False   # is_italic
-        )
+        # Index inverse (police, taille, couleur) -> balise, construit au premier span
+        # hors style par défaut : les blocs de texte courant n'en ont jamais besoin
+        tag_by_style_key = None
         
         # Reconstruire le texte avec balises de style
         styled_parts = []
         
-        for span in span_styles:
-            current_style_key = (span['font'], span['size'], span['color'], span['is_bold'], span['is_italic'])
+        for span in matching_spans:
+            # ✅ CORRECTION : Ignorer les spans sans texte
+            span_text = span.get('text')
+            if not span_text:
+                continue
+            
+            span_style_key = _span_style_key(span)
             
             # Comparer avec le style par défaut
-            if (span['font'] == default_style.get('police') and 
-                span['size'] == default_style.get('taille') and 
-                span['color'] == default_style.get('couleur')):
+            if span_style_key == default_style_key:
                 # Style dominant : pas de balise
-                styled_parts.append(span['text'])
+                styled_parts.append(span_text)
             else:
                 # Style additionnel : chercher la balise correspondante dans additional_styles
-                style_tag = None
-                for tag, style_info in additional_styles.items():
-                    if (style_info.get('police') == span['font'] and 
-                        style_info.get('taille') == span['size'] and 
-                        style_info.get('couleur') == span['color']):
-                        style_tag = tag
-                        break
+                if tag_by_style_key is None:
+                    # Premier tag retenu en cas de doublon, comme l'ancienne recherche linéaire
+                    tag_by_style_key = {}
+                    for tag, style_info in additional_styles.items():
+                        tag_by_style_key.setdefault(_style_key(style_info), tag)
+                style_tag = tag_by_style_key.get(span_style_key)
                 
                 if style_tag:
-                    styled_parts.append(f"<{style_tag}>{span['text']}</{style_tag}>")
+                    styled_parts.append(f"<{style_tag}>{span_text}</{style_tag}>")
                 else:
                     # Si pas de style additionnel trouvé, ajouter sans balise
-                    styled_parts.append(span['text'])
+                    styled_parts.append(span_text)
+        
+        if not styled_parts:
+            return ""
         
         styled_content = "".join(styled_parts)
         
         # Nettoyer les espaces multiples et formater proprement
-        styled_content = re.sub(r'\s+', ' ', styled_content).replace(' </', '</').replace('> <', '><')
+        styled_content = _tidy_styled_content(styled_content)
         
         return styled_content
 
@@ -1297,13 +1683,19 @@ class DualOutputGenerator:
             return styled_text
         
         block_mapping = style_mapping[block_id]
+        if not block_mapping or '<' not in styled_text:
+            return styled_text
         
-        for local_style, global_style in block_mapping.items():
-            # Remplacer <s1> par <gs1> et </s1> par </gs1>
-            styled_text = styled_text.replace(f"<{local_style}>", f"<{global_style}>")
-            styled_text = styled_text.replace(f"</{local_style}>", f"</{global_style}>")
+        # Une seule regex par ensemble de balises locales, partagée entre les blocs
+        # (clé = les balises et non id(), le mapping pouvant être complété en place)
+        tags_key = tuple(block_mapping)
+        tag_re = self._style_tag_re_cache.get(tags_key)
+        if tag_re is None:
+            tag_re = re.compile(r'<(/?)(' + '|'.join(map(re.escape, tags_key)) + r')>')
+            self._style_tag_re_cache[tags_key] = tag_re
         
-        return styled_text
+        # Remplacer <s1> par <gs1> et </s1> par </gs1> en un seul passage
+        return tag_re.sub(lambda m: f"<{m.group(1)}{block_mapping[m.group(2)]}>", styled_text)
 
     def _rebuild_styled_content_from_spans_with_reference(
         self, 
@@ -1333,20 +1725,16 @@ class DualOutputGenerator:
         # Créer un mapping inverse : style_info -> tag
         style_to_tag = {}
         for tag, style_info in group_additional_styles.items():
-            style_key = (
-                style_info.get('police'),
-                style_info.get('taille'),
-                style_info.get('couleur')
-            )
-            style_to_tag[style_key] = tag
+            style_to_tag[_style_key(style_info)] = tag
+        
+        reference_style_key = _style_key(reference_default_style)
+        block_style_key = _style_key(block_default_style)
+        
+        # Numérotation des nouvelles balises sN, amorcée au premier besoin
+        local_tag_counter = None
         
         for span in matching_spans:
-            span_style_key = (span.get('font_name'), span.get('font_size'), span.get('color_rgb'))
-            reference_style_key = (
-                reference_default_style.get('police'),
-                reference_default_style.get('taille'),
-                reference_default_style.get('couleur')
-            )
+            span_style_key = _span_style_key(span)
             
             # Comparer avec le style de référence du groupe
             if span_style_key == reference_style_key:
@@ -1362,24 +1750,17 @@ class DualOutputGenerator:
                 else:
                     # Style non répertorié : créer une nouvelle balise
                     # (cela arrive quand le default_style du bloc diffère de la référence)
-                    block_style_key = (
-                        block_default_style.get('police'),
-                        block_default_style.get('taille'),
-                        block_default_style.get('couleur')
-                    )
-                    
                     if span_style_key == block_style_key:
                         # Le span correspond au default_style du bloc actuel
                         # qui diffère de la référence du groupe
                         # Il faut créer une balise pour ce style
                         
                         # Générer un nouveau tag
-                        existing_tags = [tag for tag in group_additional_styles.keys() if tag.startswith('s')]
-                        if existing_tags:
-                            max_num = max([int(tag[1:]) for tag in existing_tags if tag[1:].isdigit()] + [0])
-                            new_tag = f"s{max_num + 1}"
-                        else:
-                            new_tag = "s1"
+                        if local_tag_counter is None:
+                            existing_nums = [int(tag[1:]) for tag in group_additional_styles
+                                             if tag.startswith('s') and tag[1:].isdigit()]
+                            local_tag_counter = itertools.count(max(existing_nums, default=0) + 1)
+                        new_tag = sys.intern(f"s{next(local_tag_counter)}")
                         
                         # Ajouter au mapping
                         group_additional_styles[new_tag] = {
@@ -1397,10 +1778,61 @@ class DualOutputGenerator:
         styled_content = "".join(styled_parts)
         
         # Nettoyer les espaces
-        styled_content = re.sub(r'\s+', ' ', styled_content).replace(' </', '</').replace('> <', '><')
+        styled_content = _tidy_styled_content(styled_content)
         
         return styled_content
 
+    def _precompute_page_arrays(self, page_blocks: List[Dict], page_idx: int = None) -> Dict[str, List]:
+        """
+        Agréger en une passe NumPy les données des spans de toute une page, par bloc.
+        
+        Args:
+            page_blocks: Blocs enrichis de la page
+            page_idx: Index de page ; si fourni, calcule aussi 'line_count'
+        
+        Returns:
+            {'block_text_len': longueur de texte cumulée des spans de chaque bloc,
+             'avg_font_size': taille de police moyenne des spans de chaque bloc (10 par défaut),
+             'line_count': nombre de lignes estimé de chaque bloc (cf. _calculate_line_count_from_bbox)}
+        """
+        block_count = len(page_blocks)
+        span_counts = [len(b.get('matching_spans', [])) for b in page_blocks]
+        total_spans = sum(span_counts)
+        all_spans = [s for b in page_blocks for s in b.get('matching_spans', [])]
+        
+        # Indice du bloc de chaque span, pour des sommes par bloc via bincount
+        # (accumulation dans l'ordre des spans, comme sum())
+        block_index = np.repeat(np.arange(block_count), span_counts)
+        text_len = np.fromiter((len(s.get('text') or '') for s in all_spans), dtype=np.float64, count=total_spans)
+        font_size = np.fromiter((s.get('font_size') or 0 for s in all_spans), dtype=np.float64, count=total_spans)
+        
+        block_text_len = np.bincount(block_index, weights=text_len, minlength=block_count).astype(np.int64)
+        size_sums = np.bincount(block_index, weights=font_size, minlength=block_count)
+        size_counts = np.bincount(block_index, weights=(font_size != 0), minlength=block_count)
+        avg_font_size = np.divide(size_sums, size_counts, out=np.full(block_count, 10.0), where=size_counts > 0)
+        
+        arrays = {
+            'block_text_len': block_text_len.tolist(),
+            'avg_font_size': avg_font_size.tolist(),
+        }
+        
+        if page_idx is not None:
+            # Même calcul que _calculate_line_count_from_bbox, pour toute la page à la fois
+            # (bbox absente ou incomplète : 1 ligne)
+            bbox_heights = np.full(block_count, np.nan)
+            for i, block in enumerate(page_blocks):
+                bbox = block.get('mineru_original', {}).get('bbox')
+                if bbox and len(bbox) >= 4:
+                    bbox_heights[i] = bbox[3] - bbox[1]
+            
+            page_height = self.page_dimensions[page_idx][1]
+            line_height_normalized = (avg_font_size * 1.2) / page_height
+            with np.errstate(invalid='ignore'):
+                line_count = np.maximum(1, np.round(bbox_heights / line_height_normalized))
+            arrays['line_count'] = np.where(np.isnan(bbox_heights), 1, line_count).astype(np.int64).tolist()
+        
+        return arrays
+
     def _calculate_line_count_from_bbox(self, bbox: List, matching_spans: List, page_idx: int) -> int:
         """
         ✅ NOUVELLE FONCTION : Calcule le nombre de lignes depuis la hauteur de la bbox.
@@ -1433,162 +1865,289 @@ class DualOutputGenerator:
         return line_count
 
 
-    def _generate_formatting_format(self, enriched_data: List):
-        """Générer le format de mise en page avec styles globaux unifiés."""
-        
-        def get_or_create_global_style(style_dict):
-            """
-            Ajoute un style au dictionnaire global ou retourne sa clé s'il existe déjà.
-            On normalise la taille de police pour éviter les doublons dus aux flottants.
-            """
-            raw_size = style_dict.get('taille', 0)
-
-            # Normalisation de la taille :
-            # - Si pas de taille valide, on met 0
-            # - Sinon, on arrondit à 0.1 pt (tu peux passer à 0.5 si tu veux regrouper plus agressivement)
-            try:
-                size = float(raw_size)
-            except (TypeError, ValueError):
-                size = 0.0
-
-            # Arrondi à 0.1 pt
-            normalized_size = 0.2 * round(size / 0.2)
-
-            # Construire la signature à partir de la taille normalisée
-            style_signature = (
-                style_dict.get('police', ''),
-                normalized_size,
-                style_dict.get('couleur', 0)
-            )
+    def _get_or_create_formatting_style(self, style_dict: Dict) -> str:
+        """
+        Ajoute un style au dictionnaire global ou retourne sa clé s'il existe déjà.
+        On normalise la taille de police pour éviter les doublons dus aux flottants.
+        """
+        raw_size = style_dict.get('taille', 0)
 
-            # Vérifier si ce style existe déjà
-            if style_signature in self.style_mapping:
-                return self.style_mapping[style_signature]
+        # Les blocs partagent quelques styles : résultat mémorisé sur les valeurs brutes
+        raw_key = (style_dict.get('police', ''), raw_size, style_dict.get('couleur', 0))
+        try:
+            cached_key = self._formatting_style_cache.get(raw_key)
+        except TypeError:
+            # Valeur non hachable (ex. couleur en liste) : pas de mémorisation
+            raw_key = cached_key = None
+        if cached_key is not None:
+            return cached_key
+
+        # Normalisation de la taille :
+        # - Si pas de taille valide, on met 0
+        # - Sinon, on arrondit à 0.2 pt, en pas entiers pour une signature exacte
+        size_bucket = _size_bucket(raw_size)
+        normalized_size = 0.2 * size_bucket
+
+        # Construire la signature à partir de la taille normalisée
+        style_signature = (
+            style_dict.get('police', ''),
+            size_bucket,
+            style_dict.get('couleur', 0)
+        )
 
+        # Vérifier si ce style existe déjà
+        key = self.style_mapping.get(style_signature)
+        if key is None:
             # Sinon, créer un nouveau style global
-            existing_numbers = [int(k[2:]) for k in self.global_styles.keys() if k.startswith('gs')]
-            next_number = max(existing_numbers, default=0) + 1
-
-            key = f"gs{next_number}"
-            self.global_styles[key] = {
+            key = self._add_global_style({
                 "police": style_dict.get('police', ''),
                 "taille": normalized_size,
                 "couleur": style_dict.get('couleur', 0)
-            }
+            })
             self.style_mapping[style_signature] = key
 
-            return key
+        if raw_key is not None:
+            self._formatting_style_cache[raw_key] = key
+
+        return key
+
+    def _register_block_styles(self, block: Dict, block_default_style_refs: Dict[str, str]):
+        """Enregistrer les styles (default + additional) d'un bloc comme styles globaux."""
+        block_id = block.get('id')
+
+        # Traiter le default_style
+        default_style = block.get('default_style', {})
+        if default_style:
+            gs_key = self._get_or_create_formatting_style(default_style)
+            block_default_style_refs[block_id] = gs_key
+
+        # Traiter les additional_styles
+        additional_styles = block.get('additional_styles', {})
+        if additional_styles:
+            get_style = self._get_or_create_formatting_style
+            refs = {local_key: get_style(style) for local_key, style in additional_styles.items()}
+            # Fusion si le bloc a déjà des références (id dupliqué, second appel)
+            existing_refs = self.block_additional_style_refs.get(block_id)
+            if existing_refs is None:
+                self.block_additional_style_refs[block_id] = refs
+            else:
+                existing_refs.update(refs)
+
+    def _build_formatting_block(self, block: Dict, page_idx: int, block_default_style_refs: Dict[str, str],
+                                line_count: int = None, page_dims: Tuple = None):
+        """
+        Construire l'entrée de mise en page d'un bloc.
+
+        Args:
+            line_count: Nombre de lignes déjà estimé pour la page (cf. _precompute_page_arrays)
+            page_dims: Dimensions de la page, résolues une fois par page par l'appelant
+
+        Returns:
+            Dictionnaire du bloc, ou None si le bloc est exclu de la sortie
+        """
+        block_type = block.get('block_type')
+        if not (block_type and block.get('include_in_output', True)):
+            return None
+
+        matching_spans = block.get('matching_spans', [])
+        default_style = block['default_style']
+        mineru_bbox = block.get('mineru_original', {}).get('bbox')
+
+        # Recalculer position_xy depuis mineru_original.bbox
+        if mineru_bbox is not None:
+            bbox = mineru_bbox
+            if page_dims is None:
+                page_dims = self.page_dimensions[page_idx]
+            page_width, page_height = page_dims[0], page_dims[1]
+            position_xy = (bbox[0] * page_width, bbox[1] * page_height)
+            max_allowable_width = (bbox[2] - bbox[0]) * page_width
+        else:
+            position_xy = block['position_xy']
+            max_allowable_width = block['max_allowable_width']
+
+        calculated_line_spacing = self._calculate_average_line_spacing(
+            matching_spans,
+            default_style
+        )
+
+        block_id = block['id']
+        formatting_block = {
+            "id": block_id,
+            "block_type": block_type,
+            "position_xy": position_xy,
+            "lignes_originales": line_count if line_count is not None else self._calculate_line_count_from_bbox(
+                mineru_bbox if mineru_bbox is not None else [],
+                matching_spans,
+                page_idx
+            ),
+            "max_allowable_width": max_allowable_width,
+            "interligne_normal": calculated_line_spacing,
+            "alignment": "left",  # ancien champ, laissé pour compat éventuelle
+            "align": block.get('align', 'left'),
+            "default_style": default_style,
+            "styles": block['additional_styles']
+        }
+
+        # Référence au style global par défaut
+        default_style_ref = block_default_style_refs.get(block_id)
+        if default_style_ref is not None:
+            formatting_block['default_style_ref'] = default_style_ref
+
+        # Gestion des listes "anciennes" (list_marker) – conservée pour compat
+        if block_type == 'list_item' and 'list_marker' in block:
+            formatting_block['list_marker'] = block['list_marker']
+
+        # ✅ NOUVEAU : Copie des propriétés de liste manuelles, puis des SVGs
+        formatting_block.update({key: block[key] for key in _FORMATTING_PASSTHROUGH_KEYS if key in block})
+
+        # Gestion des groupes fusionnés
+        merge_group_id = block.get('merge_group_id')
+        if merge_group_id:
+            formatting_block['merge_group_id'] = merge_group_id
+            formatting_block['merge_order'] = block.get('merge_order', 0)
+            formatting_block['is_merged_member'] = True
+
+        return formatting_block
+
+    def _generate_formatting_format(self, enriched_data: List):
+        """Générer le format de mise en page avec styles globaux unifiés."""
 
-        
         # ✅ Premier passage - collecter TOUS les styles (default + additional)
         block_default_style_refs = {}
-        
+
         for page_blocks in enriched_data:
             for block in page_blocks:
-                block_id = block.get('id')
-                
-                # Traiter le default_style
-                default_style = block.get('default_style', {})
-                if default_style:
-                    gs_key = get_or_create_global_style(default_style)
-                    block_default_style_refs[block_id] = gs_key
-                
-                # Traiter les additional_styles
-                additional_styles = block.get('additional_styles', {})
-                if additional_styles:
-                    if block_id not in self.block_additional_style_refs:
-                        self.block_additional_style_refs[block_id] = {}
-                    
-                    for local_key, style in additional_styles.items():
-                        gs_key = get_or_create_global_style(style)
-                        self.block_additional_style_refs[block_id][local_key] = gs_key
-        
+                self._register_block_styles(block, block_default_style_refs)
+
         print(f"[INFO] {len(self.global_styles)} styles globaux collectés")
-        
+
         # Créer la structure du fichier de formatage
         formatting_data = {
             "global_styles": self.global_styles,
             "pages": []
         }
-        
+
         # Création du formatage : blocs avec styles locaux conservés (pour rétrocompatibilité)
         for page_idx, page_blocks in enumerate(enriched_data):
-            page_info = {
-                "page_number": page_idx + 1,
-                "dimensions": self.page_dimensions[page_idx],
-                "blocks": []
-            }
-            
+            formatting_data["pages"].append(
+                self._build_formatting_page(page_idx, page_blocks, block_default_style_refs)
+            )
+
+        return formatting_data
+
+    def _collect_styles_and_groups(self, enriched_data: List) -> Tuple[Dict[str, str], Dict[str, List[Dict]]]:
+        """
+        Premier passage commun aux deux formats : styles globaux + groupes fusionnés.
+
+        Returns:
+            (block_default_style_refs, merged_groups)
+        """
+        block_default_style_refs = {}
+        merged_groups = {}
+
+        for page_blocks in enriched_data:
             for block in page_blocks:
-                if block.get('block_type') and block.get('include_in_output', True):
-                    
-                    # Recalculer position_xy depuis mineru_original.bbox
-                    if 'mineru_original' in block and 'bbox' in block['mineru_original']:
-                        bbox = block['mineru_original']['bbox']
-                        page_dims = self.page_dimensions[page_idx]
-                        position_xy = (bbox[0] * page_dims[0], bbox[1] * page_dims[1])
-                        max_allowable_width = (bbox[2] - bbox[0]) * page_dims[0]
-                    else:
-                        position_xy = block['position_xy']
-                        max_allowable_width = block['max_allowable_width']
-                    
-                    calculated_line_spacing = self._calculate_average_line_spacing(
-                        block.get('matching_spans', []),
-                        block['default_style']
-                    )
-                    
-                    formatting_block = {
-                        "id": block['id'],
-                        "block_type": block['block_type'],
-                        "position_xy": position_xy,
-                        "lignes_originales": self._calculate_line_count_from_bbox(
-                            block.get('mineru_original', {}).get('bbox', []),
-                            block.get('matching_spans', []),
-                            page_idx
-                        ),
-                        "max_allowable_width": max_allowable_width,
-                        "interligne_normal": calculated_line_spacing,
-                        "alignment": "left",  # ancien champ, laissé pour compat éventuelle
-                        "align": block.get('align', 'left'),
-                        "default_style": block['default_style'],
-                        "styles": block['additional_styles']
-                    }
-                    
-                    # Référence au style global par défaut
-                    block_id = block.get('id')
-                    if block_id in block_default_style_refs:
-                        formatting_block['default_style_ref'] = block_default_style_refs[block_id]
-                    
-                    # Gestion des listes "anciennes" (list_marker) – conservée pour compat
-                    if block['block_type'] == 'list_item' and 'list_marker' in block:
-                        formatting_block['list_marker'] = block['list_marker']
-                    
-                    # ✅ NOUVEAU : Copie des propriétés de liste manuelles
-                    if 'is_list' in block:
-                        formatting_block['is_list'] = block['is_list']
-                    if 'list_bullet' in block:
-                        formatting_block['list_bullet'] = block['list_bullet']
-                    if 'list_indent' in block:
-                        formatting_block['list_indent'] = block['list_indent']
-                    if 'list_hang' in block:
-                        formatting_block['list_hang'] = block['list_hang']
-                    
-                    # Gestion des SVGs
-                    if 'svgs_in_block' in block:
-                        formatting_block['svgs_in_block'] = block['svgs_in_block']
-                    
-                    # Gestion des groupes fusionnés
-                    if block.get('merge_group_id'):
-                        formatting_block['merge_group_id'] = block['merge_group_id']
-                        formatting_block['merge_order'] = block.get('merge_order', 0)
-                        formatting_block['is_merged_member'] = True
-                    
-                    page_info["blocks"].append(formatting_block)
-            
+                self._register_block_styles(block, block_default_style_refs)
+                merge_group_id = block.get('merge_group_id')
+                if merge_group_id:
+                    merged_groups.setdefault(merge_group_id, []).append(block)
+
+        print(f"[INFO] {len(self.global_styles)} styles globaux collectés")
+
+        return block_default_style_refs, merged_groups
+
+    def _build_formatting_page(self, page_idx: int, page_blocks: List[Dict], block_default_style_refs: Dict[str, str]) -> Dict:
+        """
+        Construire la page du format de mise en page.
+
+        Les blocs exclus (sans type ou include_in_output à False) sont écartés d'emblée,
+        avant l'estimation des lignes et la construction des entrées.
+        """
+        page_dims = self.page_dimensions[page_idx]
+        emitted = [b for b in page_blocks if b.get('block_type') and b.get('include_in_output', True)]
+        line_counts = self._precompute_page_arrays(emitted, page_idx)['line_count']
+
+        return {
+            "page_number": page_idx + 1,
+            "dimensions": page_dims,
+            "blocks": [
+                self._build_formatting_block(block, page_idx, block_default_style_refs, line_count, page_dims)
+                for block, line_count in zip(emitted, line_counts)
+            ]
+        }
+
+    def _build_page_outputs(self, page_idx: int, page_blocks: List[Dict], block_default_style_refs: Dict[str, str]) -> Tuple[Dict, List[Dict]]:
+        """
+        Construire la page de formatage et les entrées de traduction hors groupes d'une page.
+
+        Returns:
+            (page_info, translation_entries)
+        """
+        style_mapping = self.block_additional_style_refs
+        page_info = self._build_formatting_page(page_idx, page_blocks, block_default_style_refs)
+        entries = []
+
+        for block in page_blocks:
+            if not block.get('merge_group_id'):
+                entry = self._build_translation_entry(block, style_mapping)
+                if entry:
+                    entries.append(entry)
+
+        return page_info, entries
+
+    def _generate_both_formats(self, enriched_data: List) -> Tuple[List[Dict], Dict]:
+        """
+        Générer les formats de traduction et de mise en page en un seul parcours.
+
+        Équivaut à _generate_formatting_format puis _generate_translation_format :
+        les styles globaux sont collectés d'abord, puis chaque bloc produit ses
+        deux entrées dans la même boucle.
+
+        Returns:
+            (translation_data, formatting_data)
+        """
+        block_default_style_refs, merged_groups = self._collect_styles_and_groups(enriched_data)
+
+        formatting_data = {
+            "global_styles": self.global_styles,
+            "pages": []
+        }
+        translation_data = self._build_merged_group_entries(merged_groups, self.block_additional_style_refs)
+
+        for page_idx, page_blocks in enumerate(enriched_data):
+            page_info, entries = self._build_page_outputs(page_idx, page_blocks, block_default_style_refs)
             formatting_data["pages"].append(page_info)
-        
-        return formatting_data
+            translation_data.extend(entries)
+
+        return translation_data, formatting_data
+
+    def _write_both_formats(self, enriched_data: List, translation_file: str, formatting_file: str):
+        """
+        Écrire les deux fichiers JSON page par page, sans construire les documents complets.
 
+        Le contenu est identique à json.dump(..., indent=2, ensure_ascii=False)
+        des résultats de _generate_both_formats.
+        """
+        block_default_style_refs, merged_groups = self._collect_styles_and_groups(enriched_data)
+
+        with open(translation_file, 'w', encoding='utf-8') as tf, \
+                open(formatting_file, 'w', encoding='utf-8') as ff:
+            pages_writer = StreamingJsonArrayWriter(ff, level=1)
+            ff.write('{\n  "global_styles": ')
+            ff.write(pages_writer.encode(self.global_styles, level=1))
+            ff.write(',\n  "pages": ')
+
+            with StreamingJsonArrayWriter(tf) as translation_writer, pages_writer:
+                for entry in self._build_merged_group_entries(merged_groups, self.block_additional_style_refs):
+                    translation_writer.write(entry)
+
+                for page_idx, page_blocks in enumerate(enriched_data):
+                    page_info, entries = self._build_page_outputs(page_idx, page_blocks, block_default_style_refs)
+                    pages_writer.write(page_info)
+                    for entry in entries:
+                        translation_writer.write(entry)
+
+            ff.write('\n}')
 
 
 def main():
@@ -1618,6 +2177,9 @@ def main():
         print(f"❌ JSON MinerU non trouvé: {mineru_json_path}")
         sys.exit(1)
 
+    # Pool de processus réservé à la ligne de commande, plafonné
+    max_workers = min(os.cpu_count() or 1, CLI_MAX_WORKERS)
+
     try:
         generator = DualOutputGenerator(
             enriched_data=self.data_manager.enriched_data,
@@ -1626,7 +2188,7 @@ def main():
 
         # Génération normale
         translation_file, formatting_file, template_file = generator.generate_dual_outputs(
-            pdf_path, base_name=base_name
+            pdf_path, base_name=base_name, max_workers=max_workers
         )
 
         # Diagnostic si demandé
@@ -1644,7 +2206,7 @@ def main():
         else:
             print(f"📖 Génération depuis MinerU...")
             mineru_data = generator._load_mineru_data(mineru_json_path)
-            enriched_data = generator._process_with_visual_matching(pdf_path, mineru_data)
+            enriched_data = generator._process_with_visual_matching(pdf_path, mineru_data, max_workers=max_workers)
 
             diagnostic_file = generator.create_visual_diagnostic(pdf_path, enriched_data, base_name)
 
@@ -6,17 +6,21 @@ Gestion des métadonnées de validation
 
 import json
 import os
-from collections import Counter
 from typing import List, Dict, Any
 
 
-def save_validation_metadata(base_name: str, enriched_data: List[List[Dict[str, Any]]]) -> str:
+# Diagnostic des doublons d'isolated_spans au chargement (développement)
+DIAGNOSTIC = bool(os.environ.get('BM_DIAGNOSTIC'))
+
+def save_validation_metadata(base_name: str, enriched_data: List[List[Dict[str, Any]]],
+                             pretty: bool = False) -> str:
     """
     Sauvegarder les métadonnées de validation
     
     Args:
         base_name: Nom de base du projet
         enriched_data: Données enrichies
+        pretty: Indenter le JSON (lisible), sinon format compact
         
     Returns:
         Chemin du fichier de métadonnées créé
@@ -36,8 +40,13 @@ def save_validation_metadata(base_name: str, enriched_data: List[List[Dict[str,
         }
         
         for block in page_blocks:
+            block_type = block.get('block_type')
+            if not block_type:
+                continue
+            span_ids = [s['id'] for s in block.get('matching_spans', [])]
+            
             # Blocs MinerU normaux
-            if block.get('block_type') and block.get('block_type') != 'isolated_span':
+            if block_type != 'isolated_span':
                 total_blocks += 1
                 match_source = block.get('match_source', 'auto')
                 preserve_empty = block.get('preserve_empty', False)
@@ -51,13 +60,13 @@ def save_validation_metadata(base_name: str, enriched_data: List[List[Dict[str,
                     'id': block['id'],
                     'match_source': match_source,
                     'preserve_empty': preserve_empty,
-                    'spans_count': len(block.get('matching_spans', [])),
-                    'span_ids': [s['id'] for s in block.get('matching_spans', [])]
+                    'spans_count': len(span_ids),
+                    'span_ids': span_ids
                 }
                 page_metadata['blocks'].append(block_metadata)
             
             # Isolated spans
-            elif block.get('block_type') == 'isolated_span':
+            else:
                 include = block.get('include_in_output', True)
                 if include:
                     isolated_included += 1
@@ -66,15 +75,19 @@ def save_validation_metadata(base_name: str, enriched_data: List[List[Dict[str,
                     'id': block['id'],
                     'block_type': 'isolated_span',
                     'include_in_output': include,
-                    'span_ids': [s['id'] for s in block.get('matching_spans', [])]
+                    'span_ids': span_ids
                 }
                 page_metadata['blocks'].append(block_metadata)
         
         metadata['pages'].append(page_metadata)
     
-    # Sauvegarder
+    # Sauvegarder (document encodé d'un bloc puis écrit en une fois)
+    if pretty:
+        metadata_json = json.dumps(metadata, indent=2, ensure_ascii=False)
+    else:
+        metadata_json = json.dumps(metadata, ensure_ascii=False, separators=(',', ':'))
     with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+        f.write(metadata_json)
     
     print(f"\n✅ Métadonnées sauvegardées: {metadata_file}")
     print(f"   - {total_blocks} blocs MinerU")
@@ -107,20 +120,22 @@ def load_validation_metadata(base_name: str, enriched_data: List[List[Dict[str,
         with open(metadata_file, 'r', encoding='utf-8') as f:
             metadata = json.load(f)
         
-        # Collecter les spans PAR PAGE
+        # Collecter les spans PAR PAGE et réinitialiser les matching_spans en un passage
+        # (ids des isolated_spans existants relevés au passage)
         spans_by_page = {}
+        isolated_ids_by_page = {}
         for page_num, page_blocks in enumerate(enriched_data):
-            spans_by_page[page_num] = {}
+            page_spans = spans_by_page[page_num] = {}
+            isolated_ids = isolated_ids_by_page[page_num] = set()
             for block in page_blocks:
                 for span in block.get('matching_spans', []):
-                    if span['id'] not in spans_by_page[page_num]:
-                        spans_by_page[page_num][span['id']] = span
-        
-        # Réinitialiser les matching_spans
-        for page_num, page_blocks in enumerate(enriched_data):
-            for block in page_blocks:
+                    # Premier span rencontré pour un id conservé
+                    page_spans.setdefault(span['id'], span)
+                
                 if block.get('block_type') != 'isolated_span':
                     block['matching_spans'] = []
+                else:
+                    isolated_ids.add(block['id'])
         
         # Reconstruire selon métadonnées
         total_manual = 0
@@ -174,10 +189,7 @@ def load_validation_metadata(base_name: str, enriched_data: List[List[Dict[str,
             
             if unassigned:
                 total_unassigned += len(unassigned)
-                existing_ids = {
-                    b['id'] for b in enriched_data[page_num] 
-                    if b.get('block_type') == 'isolated_span'
-                }
+                existing_ids = isolated_ids_by_page[page_num]
                 
                 for span_id in unassigned:
                     span = page_spans[span_id]
@@ -214,20 +226,23 @@ def load_validation_metadata(base_name: str, enriched_data: List[List[Dict[str,
         print(f"   - {total_isolated_included} isolated spans inclus")
         print(f"   - {total_unassigned} spans non assignés")
         
-        # Diagnostic isolated_spans
-        print(f"\n📊 Diagnostic isolated_spans:")
-        for page_num, page_blocks in enumerate(enriched_data):
-            isolated = [b for b in page_blocks if b.get('block_type') == 'isolated_span']
-            isolated_ids = [b['id'] for b in isolated]
-            
-            if len(isolated_ids) != len(set(isolated_ids)):
-                print(f"   ⚠️ Page {page_num+1}: DOUBLONS détectés!")
-                counts = Counter(isolated_ids)
-                for block_id, count in counts.items():
-                    if count > 1:
-                        print(f"      - {block_id}: {count} fois")
-            else:
-                print(f"   ✅ Page {page_num+1}: {len(isolated)} isolated_spans")
+        # Diagnostic isolated_spans (activé par BM_DIAGNOSTIC)
+        if DIAGNOSTIC:
+            print(f"\n📊 Diagnostic isolated_spans:")
+            for page_num, page_blocks in enumerate(enriched_data):
+                isolated_ids = [b['id'] for b in page_blocks if b.get('block_type') == 'isolated_span']
+                
+                if len(set(isolated_ids)) != len(isolated_ids):
+                    print(f"   ⚠️ Page {page_num+1}: DOUBLONS détectés!")
+                    # Occurrences par id, dans l'ordre de première apparition
+                    counts = {}
+                    for block_id in isolated_ids:
+                        counts[block_id] = counts.get(block_id, 0) + 1
+                    for block_id, count in counts.items():
+                        if count > 1:
+                            print(f"      - {block_id}: {count} fois")
+                else:
+                    print(f"   ✅ Page {page_num+1}: {len(isolated_ids)} isolated_spans")
         
         return enriched_data
     
@@ -10,6 +10,8 @@ from reportlab.pdfbase.ttfonts import TTFont
 import re
 import argparse
 import copy
+import hashlib
+from functools import lru_cache
 
 # --- REPORTLAB pour SVG ---
 from svglib.svglib import svg2rlg
@@ -22,6 +24,17 @@ FONT_MAPPING_FILE = 'font_mapping.json'
 SVG_DIR = 'svgs'
 SVG_MAPPING_FILENAME_SUFFIX = '_svg_mapping.json'
 
+# --- EXPRESSIONS RÉGULIÈRES (compilées une fois) ---
+_TOKEN_RE = re.compile(r'\s+|\S+')
+_STYLE_TAG_RE = re.compile(r'<(s\d+)>(.*?)</\1>')
+_TAG_RE = re.compile(r'<(gs\d+)>(.*?)</\1>|<svg id="([^"]*)"\s*/>|([^<]+)', re.DOTALL)
+_MULTI_SPACE_RE = re.compile(r' +')
+
+_LIST_MARKERS = ['•', '◦', '▪', '▫', '‣', '⁃', '⁌', '⁍', '*', '○', '●']
+# Un motif par puce, appliqués dans l'ordre de la liste : avec des puces adjacentes,
+# le résultat dépend de cet ordre (une alternative unique ne le reproduit pas)
+_LIST_MARKER_PATTERNS = [(marker, re.compile(rf'(?<=\S)\s*({re.escape(marker)})\s*')) for marker in _LIST_MARKERS]
+
 # --- FONCTIONS UTILITAIRES ---
 
 # Ajouter cette nouvelle fonction après les imports
@@ -48,9 +61,35 @@ def resolve_style_ref(style_ref, global_styles, fallback_style):
 
 
 
+def _validate_styles_dict(styles_dict):
+    """
+    Valide une fois les styles globaux avant le rendu : chaque valeur doit être un dict.
+
+    Une référence ('gsN') est résolue vers le style visé ; une valeur invalide est
+    écartée (un seul message), le style par défaut du bloc s'appliquera à sa place.
+
+    Returns:
+        Nouveau dictionnaire {style_id: style}
+    """
+    validated = {}
+    for style_id, value in styles_dict.items():
+        style = resolve_style_ref(value, styles_dict, None) if isinstance(value, str) else value
+        if isinstance(style, dict):
+            validated[style_id] = style
+        else:
+            print(f"[ERREUR] Style '{style_id}' n'est pas un dict: {type(value)} = {value}")
+    return validated
+
+
 def _tokenize_preserve_spaces(s):
     """Regex pour diviser la chaîne en mots et en groupes d'espaces, en les préservant"""
-    return re.findall(r'\s+|\S+', s)
+    return _TOKEN_RE.findall(s)
+
+
+@lru_cache(maxsize=200000)
+def _cached_string_width(token, font, size):
+    """Largeur d'un token mémorisée (mêmes mots mesurés à chaque tentative de compression)"""
+    return pdfmetrics.stringWidth(token, font, size)
     
     
         
@@ -64,7 +103,7 @@ def _is_likely_definition_list(translated_text: str, tag_threshold: int = 3) ->
     2. Une majorité du contenu de ces balises doit se terminer par un deux-points.
     """
     # Expression régulière pour trouver toutes les balises de style et leur contenu
-    matches = re.findall(r'<(s\d+)>(.*?)</\1>', translated_text)
+    matches = _STYLE_TAG_RE.findall(translated_text)
 
     # Critère 1: Vérifier s'il y a suffisamment de balises pour justifier l'analyse.
     if len(matches) < tag_threshold:
@@ -119,14 +158,12 @@ def format_list_items_for_reflow(text, block_type):
     if block_type != 'list_item':
         return text
 
-    all_markers = ['•', '◦', '▪', '▫', '‣', '⁃', '⁌', '⁍', '*', '○', '●']
-    
     processed_text = text.strip()
 
-    for marker in all_markers:
-        escaped_marker = re.escape(marker)
-        pattern = rf'(?<=\S)\s*({escaped_marker})\s*'
-        processed_text = re.sub(pattern, r'\n\1 ', processed_text)
+    for marker, pattern in _LIST_MARKER_PATTERNS:
+        # Sans la puce dans le texte, la substitution ne changerait rien
+        if marker in processed_text:
+            processed_text = pattern.sub(r'\n\1 ', processed_text)
 
     return processed_text
 
@@ -191,6 +228,9 @@ def setup_fonts(font_mapping_file, font_dir, required_fonts):
         print(f"[ERREUR] Impossible de lire '{font_mapping_file}': {e}")
         return False
 
+    # Les largeurs mémorisées dépendent des polices enregistrées
+    _cached_string_width.cache_clear()
+
     all_fonts_found = True
     for font_name, font_file in font_mapping.items():
         if font_name in required_fonts and font_name not in ["SVG_Placeholder_Font", "default"]:
@@ -227,28 +267,22 @@ def parse_tagged_text(text, default_style, styles_dict, svg_mapping_data):
     Args:
         text: Texte balisé avec <gsX> ou <svg>
         default_style: Style par défaut (dict)
-        styles_dict: Dictionnaire des styles (global_styles)
+        styles_dict: Dictionnaire des styles (global_styles, validé par _validate_styles_dict)
         svg_mapping_data: Mapping des SVG
     
     Returns:
         Liste de segments avec style résolu
     """
     segments = []
-    tag_pattern = re.compile(r'<(gs\d+)>(.*?)</\1>|<svg id="([^"]*)"\s*/>|([^<]+)', re.DOTALL)
     text_processed = text
 
-    for match in tag_pattern.finditer(text_processed):
+    for match in _TAG_RE.finditer(text_processed):
         if match.group(1):
             # Balise de style <gsX>
             style_id = match.group(1)
             content = match.group(2)
             style = styles_dict.get(style_id, default_style)
             
-            # Sécurité : vérifier que le style est bien un dict
-            if not isinstance(style, dict):
-                print(f"[ERREUR] Style '{style_id}' n'est pas un dict: {type(style)} = {style}")
-                style = default_style
-            
             # print(f"[TAG] {style_id}: est dans styles_dict ? {'oui' if style_id in styles_dict else 'non'} | Valeur: {style}")
 
             if content:
@@ -292,21 +326,86 @@ def parse_tagged_text(text, default_style, styles_dict, svg_mapping_data):
     # Normalisation des espaces multiples
     for seg in corrected_segments:
         if seg['type'] == 'text':
-            seg['text'] = re.sub(r' +', ' ', seg['text'])
+            seg['text'] = _MULTI_SPACE_RE.sub(' ', seg['text'])
 
     return corrected_segments
 
 
 
+def _load_svg(file_path, svg_cache):
+    """
+    Charge un SVG en Drawing ReportLab, mémorisé dans svg_cache le temps d'une construction.
+
+    Le cache est indexé par chemin : les ids SVG qui pointent vers le même
+    fichier partagent une seule lecture. Le Drawing n'est jamais modifié au rendu
+    (échelle et position passent par le canvas) : l'objet mémorisé peut être
+    redessiné tel quel. Un échec de lecture est aussi mémorisé pour ne pas
+    réessayer à chaque occurrence.
+
+    Returns:
+        Drawing, ou None si le fichier n'a pas pu être lu
+    """
+    if file_path not in svg_cache:
+        try:
+            svg_cache[file_path] = svg2rlg(file_path)
+        except Exception as e:
+            print(f"[ERREUR SVG] {os.path.basename(file_path)} : {e}")
+            svg_cache[file_path] = None
+    return svg_cache[file_path]
+
+
+def _svg_form(c, file_path, drawing):
+    """
+    Nom du XObject (form) contenant le Drawing dans le PDF du canvas, créé au premier usage.
+
+    Chaque occurrence d'un SVG référence ensuite le même objet (doForm) au lieu de
+    réécrire tous ses tracés dans le flux de la page. Le nom dérive du chemin du
+    fichier, comme la clé de svg_cache.
+    """
+    form_name = "svg" + hashlib.md5(file_path.encode('utf-8')).hexdigest()
+    if not c.hasForm(form_name):
+        x0, y0, x1, y1 = drawing.getBounds() or (0, 0, drawing.width, drawing.height)
+        # Marge pour les traits épais, qui débordent des bornes géométriques
+        margin = max(x1 - x0, y1 - y0, 1)
+        c.beginForm(form_name, lowerx=x0 - margin, lowery=y0 - margin, upperx=x1 + margin, uppery=y1 + margin)
+        renderPDF.draw(drawing, c, 0, 0)
+        c.endForm()
+    return form_name
+
+
+@lru_cache(maxsize=1024)
 def int_to_rgb(color_int):
-    """Convertit une couleur entière en tuple RGB normalisé"""
+    """Convertit une couleur entière en tuple RGB normalisé (peu de couleurs par document : mémorisé)"""
     red = (color_int >> 16) & 255
     green = (color_int >> 8) & 255
     blue = color_int & 255
     return (red/255.0, green/255.0, blue/255.0)
 
 
-def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_space=0, **kwargs):
+def _pretokenize_segments(segments):
+    """
+    Découpe une fois pour toutes les segments texte en lignes puis en tokens.
+
+    Returns:
+        Liste parallèle à segments : pour un segment texte, liste des lignes
+        (séparées par '\n'), chacune étant la liste de ses tokens (token, nb_car) ;
+        None pour un SVG. nb_car vaut len(token) pour un mot, 0 pour des espaces
+        (ni char_space ni coupure de ligne sur les espaces).
+    """
+    pretokenized = []
+    for segment in segments:
+        if segment['type'] == 'text':
+            pretokenized.append([
+                [(token, len(token) if token.strip() else 0) for token in _tokenize_preserve_spaces(part)]
+                for part in segment['text'].split('\n')
+            ])
+        else:
+            pretokenized.append(None)
+    return pretokenized
+
+
+def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_space=0, pretokenized=None,
+                     count_only=False, **kwargs):
     """
     Calcule le wrapping des lignes pour un bloc.
     
@@ -321,6 +420,10 @@ def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_s
             - 'is_list' (bool)
             - 'list_indent' (float)
             - 'list_hang' (bool)
+    pretokenized : résultat de _pretokenize_segments(segments), à fournir
+        quand le même bloc est recalculé plusieurs fois (cf. compress_block_lines)
+    count_only : pour les tentatives dont seul le nombre de lignes compte ;
+        les éléments de ligne ne sont alors pas construits (seul len() est valable)
     """
     # Compatibilité éventuelle avec anciens kwargs
     if 'fontscale' in kwargs:
@@ -369,15 +472,17 @@ def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_s
     # Largeur max effective pour la première ligne
     effective_maxwidth = get_effective_maxwidth(line_index)
 
-    for segment in segments:
+    if pretokenized is None:
+        pretokenized = _pretokenize_segments(segments)
+
+    for segment, segment_parts in zip(segments, pretokenized):
         if segment['type'] == 'text':
             style = segment['style']
             font = style.get("police", "Helvetica") or "Helvetica"
             size = style.get("taille", 10.5) * font_scale
 
-            # Gestion des sauts de ligne internes
-            parts = segment['text'].split('\n')
-            for i, part in enumerate(parts):
+            # Gestion des sauts de ligne internes (lignes déjà découpées en tokens)
+            for i, tokens in enumerate(segment_parts):
                 if i > 0:
                     # On pousse la ligne courante et démarre une nouvelle
                     if current_line:
@@ -387,28 +492,25 @@ def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_s
                     line_index += 1
                     effective_maxwidth = get_effective_maxwidth(line_index)
 
-                if not part:
+                if not tokens:
                     # Ligne vide : on laisse la ligne telle quelle (sera traitée comme ligne vide)
                     continue
 
-                # On découpe en tokens (espaces + mots)
-                tokens = re.findall(r'\s+|\S+', part)
-
-                for token in tokens:
-                    # Largeur du token + char_space éventuel
-                    base_w = pdfmetrics.stringWidth(token, font, size)
-                    extra_cs = (len(token) * char_space) if token.strip() else 0.0
-                    w = base_w + extra_cs
-
-                    # Si on dépasse la largeur max et qu'il y a déjà du contenu sur la ligne, on coupe
-                    if token.strip() and current_width + w > effective_maxwidth and current_line:
-                        lines.append(current_line)
-                        current_line = []
-                        current_width = 0.0
-                        line_index += 1
-                        effective_maxwidth = get_effective_maxwidth(line_index)
-
-                    current_line.append({
+                for token, n_chars in tokens:
+                    # Largeur du token + char_space éventuel (mots seulement)
+                    w = _cached_string_width(token, font, size)
+                    if n_chars:
+                        w += n_chars * char_space
+
+                        # Si on dépasse la largeur max et qu'il y a déjà du contenu sur la ligne, on coupe
+                        if current_width + w > effective_maxwidth and current_line:
+                            lines.append(current_line)
+                            current_line = []
+                            current_width = 0.0
+                            line_index += 1
+                            effective_maxwidth = get_effective_maxwidth(line_index)
+
+                    current_line.append(token if count_only else {
                         'type': 'text',
                         'text': token,
                         'width': w,
@@ -432,7 +534,7 @@ def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_s
                 line_index += 1
                 effective_maxwidth = get_effective_maxwidth(line_index)
 
-            current_line.append({
+            current_line.append(segment['id'] if count_only else {
                 'type': 'svg',
                 'id': segment['id'],
                 'props': props,
@@ -447,6 +549,33 @@ def calculate_reflow(segments, blockdata, svgmappingdata, font_scale=1.0, char_s
 
     return lines
 
+def _first_fitting(candidates, try_fit):
+    """
+    Premier candidat de la liste qui tient, par dichotomie.
+
+    Suppose que si un candidat tient, tous les suivants tiennent aussi
+    (candidats triés du moins au plus compressé).
+
+    Args:
+        candidates: Valeurs à tester, dans l'ordre de préférence
+        try_fit: Fonction candidat -> résultat, ou None si ça ne tient pas
+
+    Returns:
+        (candidat, résultat), ou (None, None) si aucun ne tient
+    """
+    found = (None, None)
+    lo, hi = 0, len(candidates)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        result = try_fit(candidates[mid])
+        if result is not None:
+            found = (candidates[mid], result)
+            hi = mid
+        else:
+            lo = mid + 1
+    return found
+
+
 def estimate_original_line_spacing(block):
     """
     Estime l'interligne (distance baseline-baseline) d'origine pour un bloc,
@@ -488,11 +617,13 @@ def compress_block_lines(segments, block_for_reflow, svg_mapping_data, max_lines
 
     Logique:
     - On fixe la hauteur de box d'après la situation d'origine (font_scale=1).
-    - Pour chaque (fs, cs) en boucle imbriquée:
-        1) On calcule les lignes.
-        2) Si len(lines) <= max_lines_original -> OK avec interligne original.
-        3) Sinon, on calcule la capacité physique max_lines_fs avec interligne "scaled":
-           - si len(lines) <= max_lines_fs -> OK (plus de lignes, même hauteur de box).
+    - Un couple (fs, cs) tient si:
+        1) len(lines) <= max_lines_original -> OK avec interligne original.
+        2) Sinon, len(lines) <= max_lines_fs, capacité physique avec interligne "scaled"
+           (plus de lignes, même hauteur de box).
+    - On retient le plus grand fs qui tient, puis à ce fs le plus petit resserrement cs.
+      Réduire fs ou cs ne fait jamais perdre la tenue : recherche par dichotomie
+      plutôt que parcours de toute la grille.
     - Si rien ne tient, on revient à fs=1.0, cs=0.0.
     """
     # Sécurité : si on n'a pas d'info sur max_lines_original, on considère "pas de limite"
@@ -505,6 +636,9 @@ def compress_block_lines(segments, block_for_reflow, svg_mapping_data, max_lines
     # Hauteur de box d'après la situation originale
     box_height = estimate_box_height_from_original(block_for_reflow)
 
+    # Segments découpés une seule fois pour toutes les tentatives
+    pretokenized = _pretokenize_segments(segments)
+
     # 1) Tentative initiale sans compression
     base_fs = 1.0
     base_cs = 0.0
@@ -513,7 +647,8 @@ def compress_block_lines(segments, block_for_reflow, svg_mapping_data, max_lines
         block_for_reflow,
         svg_mapping_data,
         font_scale=base_fs,
-        char_space=base_cs
+        char_space=base_cs,
+        pretokenized=pretokenized
     )
 
     # Si ça tient déjà dans max_lines_original, on ne fait rien
@@ -526,52 +661,69 @@ def compress_block_lines(segments, block_for_reflow, svg_mapping_data, max_lines
     best_fs = base_fs
     best_cs = base_cs
     best_mode = "original_spacing"
-    is_fitted = False
-
-    for fs in font_scale_candidates:
-        for cs in char_space_candidates:
-            lines_test = calculate_reflow(
-                segments,
-                block_for_reflow,
-                svg_mapping_data,
-                font_scale=fs,
-                char_space=cs
-            )
-            n_lines = len(lines_test)
-
-            # Cas 1 : on arrive à tenir dans le nombre de lignes original
-            if n_lines <= max_lines_original:
-                lines = lines_test
-                best_fs = fs
-                best_cs = cs
-                best_mode = "original_spacing"  # on gardera l'interligne original
-                is_fitted = True
-                if fs != 1.0 or cs != 0.0:
-                    print(f" {block_for_reflow.get('id', '?')} -> Compression (n_lignes={n_lines} <= {max_lines_original}) : fs={fs:.2f}, cs={cs:.2f}, mode=original")
-                break
 
+    # Résultats mémorisés par (fs, cs) : la dichotomie sur cs repasse par (fs, cs_min)
+    attempts = {}
+
+    def try_fit(fs, cs):
+        """(n_lignes, mode, max_lines_fs) si le couple (fs, cs) tient, sinon None"""
+        if (fs, cs) in attempts:
+            return attempts[(fs, cs)]
+
+        n_lines = len(calculate_reflow(
+            segments,
+            block_for_reflow,
+            svg_mapping_data,
+            font_scale=fs,
+            char_space=cs,
+            pretokenized=pretokenized,
+            count_only=True
+        ))
+        result = None
+
+        # Cas 1 : on arrive à tenir dans le nombre de lignes original
+        if n_lines <= max_lines_original:
+            result = (n_lines, "original_spacing", None)  # on gardera l'interligne original
+        else:
             # Cas 2 : plus de lignes que l'original, mais peut-on tenir en hauteur ?
             line_spacing_scaled = estimate_line_spacing_for_scale(block_for_reflow, fs)
-            if line_spacing_scaled <= 0:
-                continue
+            if line_spacing_scaled > 0:
+                max_lines_fs = int(box_height // line_spacing_scaled)
+                if n_lines <= max_lines_fs:
+                    # On accepte plus de lignes tant que la hauteur physique reste dans la box
+                    result = (n_lines, "scaled_spacing", max_lines_fs)
 
-            max_lines_fs = int(box_height // line_spacing_scaled)
+        attempts[(fs, cs)] = result
+        return result
 
-            if n_lines <= max_lines_fs:
-                # On accepte plus de lignes tant que la hauteur physique reste dans la box
-                lines = lines_test
-                best_fs = fs
-                best_cs = cs
-                best_mode = "scaled_spacing"
-                is_fitted = True
-                print(
-                    f" {block_for_reflow.get('id', '?')} -> Compression (n_lignes={n_lines} > {max_lines_original}, "
-                    f"mais n_lignes <= {max_lines_fs} possible) : fs={fs:.2f}, cs={cs:.2f}, mode=scaled"
-                )
-                break
+    # Plus grand fs qui tient avec le resserrement maximal, puis plus petit cs à ce fs
+    min_cs = char_space_candidates[-1]
+    fs, _ = _first_fitting(font_scale_candidates, lambda fs_test: try_fit(fs_test, min_cs))
+    is_fitted = fs is not None
 
-        if is_fitted:
-            break
+    if is_fitted:
+        cs, (n_lines, best_mode, max_lines_fs) = _first_fitting(
+            char_space_candidates, lambda cs_test: try_fit(fs, cs_test)
+        )
+        best_fs = fs
+        best_cs = cs
+        # Lignes complètes construites pour le seul couple retenu
+        lines = calculate_reflow(
+            segments,
+            block_for_reflow,
+            svg_mapping_data,
+            font_scale=fs,
+            char_space=cs,
+            pretokenized=pretokenized
+        )
+        if best_mode == "original_spacing":
+            if fs != 1.0 or cs != 0.0:
+                print(f" {block_for_reflow.get('id', '?')} -> Compression (n_lignes={n_lines} <= {max_lines_original}) : fs={fs:.2f}, cs={cs:.2f}, mode=original")
+        else:
+            print(
+                f" {block_for_reflow.get('id', '?')} -> Compression (n_lignes={n_lines} > {max_lines_original}, "
+                f"mais n_lignes <= {max_lines_fs} possible) : fs={fs:.2f}, cs={cs:.2f}, mode=scaled"
+            )
 
     if not is_fitted:
         # Fallback : garder la version non compressée (plus lisible même si ça déborde)
@@ -584,7 +736,8 @@ def compress_block_lines(segments, block_for_reflow, svg_mapping_data, max_lines
             block_for_reflow,
             svg_mapping_data,
             font_scale=base_fs,
-            char_space=base_cs
+            char_space=base_cs,
+            pretokenized=pretokenized
         )
         best_fs = base_fs
         best_cs = base_cs
@@ -716,7 +869,6 @@ def draw_text_block(c, block, lines, svg_cache):
                 x_curr += seg['width'] + (seg_spaces * word_space)
 
             elif seg['type'] == 'svg':
-                svg_id = seg['id']
                 props = seg['props']
                 w_target = seg['width']
                 h_target = seg['height']
@@ -751,13 +903,7 @@ def draw_text_block(c, block, lines, svg_cache):
 
                     elif ext == '.svg':
                         # --- GESTION DES SVG (Code existant amélioré) ---
-                        if svg_id not in svg_cache:
-                            try:
-                                svg_cache[svg_id] = svg2rlg(file_path)
-                            except Exception as e:
-                                print(f"[ERREUR SVG] {file_name} : {e}")
-
-                        drawing = svg_cache.get(svg_id)
+                        drawing = _load_svg(file_path, svg_cache)
                         
                         if drawing:
                             c.saveState()
@@ -775,8 +921,10 @@ def draw_text_block(c, block, lines, svg_cache):
                             c.scale(sx, sy)
                             
                             v_adjust = props.get('ajustement_vertical', 0)
-                            # renderPDF dessine depuis 0,0
-                            renderPDF.draw(drawing, c, 0, v_adjust/sy)
+                            # Dessin depuis 0,0, via le XObject partagé du SVG
+                            form_name = _svg_form(c, file_path, drawing)
+                            c.translate(0, v_adjust/sy)
+                            c.doForm(form_name)
                             c.restoreState()
                         else:
                             # Echec SVG -> Carré rouge
@@ -863,13 +1011,34 @@ def redistribute_merged_text_simple(merged_text, group_blocks_sorted):
     return result
 
 
+def parse_merged_group_text(merged_text, group_blocks_sorted, svg_mapping_data, global_styles):
+    """
+    Parse le texte d'un groupe fusionné en segments, avec le style par défaut du premier bloc.
+
+    Le résultat ne dépend pas de la compression : il peut être calculé une fois puis
+    passé à chaque tentative de redistribute_merged_text_fillstrategy.
+    """
+    first_block = group_blocks_sorted[0]
+    block_type = first_block.get('block_type', 'paragraph')
+    
+    # ✅ Utiliser le default_style du PREMIER bloc comme référence
+    default_style_ref = first_block.get('default_style_ref') or first_block.get('default_style')
+    resolved_default_style = global_styles.get(default_style_ref, default_style_ref) if isinstance(default_style_ref, str) else default_style_ref
+    
+    processed_text = format_list_items_for_reflow(merged_text, block_type)
+    
+    # Parser le texte en segments (préserve les balises)
+    return parse_tagged_text(processed_text, resolved_default_style, global_styles, svg_mapping_data)
+
+
 def redistribute_merged_text_fillstrategy(
     merged_text,
     group_blocks_sorted,
     svg_mapping_data,
     global_styles,
     font_scale=1.0,
-    char_space=0.0
+    char_space=0.0,
+    segments=None
 ):
     """
     ✅ CORRECTION COMPLÈTE : Redistribue le texte fusionné en remplissant séquentiellement les blocs.
@@ -881,21 +1050,18 @@ def redistribute_merged_text_fillstrategy(
     3. Passer au bloc 1, etc.
     4. Reconstruire le texte avec balises pour chaque bloc
     
+    segments : résultat de parse_merged_group_text, à fournir quand le même
+        texte est redistribué pour plusieurs compressions (non modifié)
+    
     Returns:
         Dict {block_id: text_portion} ou None si débordement total
     """
     result = {}
-    first_block = group_blocks_sorted[0]
-    block_type = first_block.get('block_type', 'paragraph')
     
-    # ✅ Utiliser le default_style du PREMIER bloc comme référence
-    default_style_ref = first_block.get('default_style_ref') or first_block.get('default_style')
-    resolved_default_style = global_styles.get(default_style_ref, default_style_ref) if isinstance(default_style_ref, str) else default_style_ref
-    
-    processed_text = format_list_items_for_reflow(merged_text, block_type)
-    
-    # Parser le texte en segments (préserve les balises)
-    segments = parse_tagged_text(processed_text, resolved_default_style, global_styles, svg_mapping_data)
+    if segments is None:
+        segments = parse_merged_group_text(merged_text, group_blocks_sorted, svg_mapping_data, global_styles)
+    # Copie : les segments découpés entre deux blocs sont remplacés dans la liste
+    segments = list(segments)
     
     segment_idx = 0
     
@@ -910,7 +1076,8 @@ def redistribute_merged_text_fillstrategy(
             
             # Tester si on peut ajouter le segment entier
             test_segments = block_segments + [current_seg]
-            test_lines = calculate_reflow(test_segments, block, svg_mapping_data, font_scale=font_scale, char_space=char_space)
+            test_lines = calculate_reflow(test_segments, block, svg_mapping_data, font_scale=font_scale, char_space=char_space,
+                                          count_only=True)
             
             if len(test_lines) <= block_lines_available:
                 # Le segment entier tient, l'ajouter
@@ -929,7 +1096,8 @@ def redistribute_merged_text_fillstrategy(
                         partial_seg = {'type': 'text', 'text': partial_text, 'style': current_seg['style']}
                         
                         test_segments_partial = block_segments + [partial_seg]
-                        test_lines_partial = calculate_reflow(test_segments_partial, block, svg_mapping_data, font_scale=font_scale, char_space=char_space)
+                        test_lines_partial = calculate_reflow(test_segments_partial, block, svg_mapping_data, font_scale=font_scale,
+                                                              char_space=char_space, count_only=True)
                         
                         if len(test_lines_partial) <= block_lines_available:
                             words_fitted = word_count
@@ -1085,6 +1253,8 @@ def _reconstruct_text_with_tags(segments, global_styles):
 def create_text_overlay_pdf(format_data, translation_data, svg_mapping_data, temp_file, global_styles):
     """Crée un PDF transparent contenant SEULEMENT le texte traduit et les SVGs, compatible styles globaux."""
     print(f"\n--- CRÉATION DU PDF TEXTE TRANSPARENT: {temp_file} ---")
+    # Styles vérifiés une fois ici plutôt qu'à chaque balise parsée
+    global_styles = _validate_styles_dict(global_styles)
     first_page_dims = format_data['pages'][0]['dimensions']
     c = canvas.Canvas(temp_file, pagesize=(first_page_dims[0], first_page_dims[1]))
     svg_cache = {}
@@ -1118,6 +1288,10 @@ def create_text_overlay_pdf(format_data, translation_data, svg_mapping_data, tem
                     redistributed = None
                     is_fitted = False
 
+                    # Texte du groupe parsé une fois pour toutes les compressions
+                    group_segments = parse_merged_group_text(translated_text, group_blocks_sorted,
+                                                             svg_mapping_data, global_styles)
+
                     # ✅ Essayer différentes compressions jusqu'à ce que tout tienne
                     for fs_test in [1.0, 0.95, 0.9, 0.85, 0.8, 0.75, 0.7]:
                         cs_test = -0.1 if fs_test > 0.85 else -0.2
@@ -1127,7 +1301,8 @@ def create_text_overlay_pdf(format_data, translation_data, svg_mapping_data, tem
                             svg_mapping_data,
                             global_styles,
                             font_scale=fs_test,
-                            char_space=cs_test
+                            char_space=cs_test,
+                            segments=group_segments
                         )
                         if redistributed_test is not None:
                             redistributed = redistributed_test
@@ -1145,7 +1320,8 @@ def create_text_overlay_pdf(format_data, translation_data, svg_mapping_data, tem
                             svg_mapping_data,
                             global_styles,
                             font_scale=0.65,
-                            char_space=-0.3
+                            char_space=-0.3,
+                            segments=group_segments
                         )
                         merged_groups_compression[merge_group_id] = (0.65, -0.3)
                         print(f" -> [AVERTISSEMENT] Compression maximale forcée pour {merge_group_id}")
@@ -1203,8 +1379,11 @@ def create_text_overlay_pdf(format_data, translation_data, svg_mapping_data, tem
                 font_scale, char_space = merged_groups_compression[merge_group_id]
                 lines = calculate_reflow(segments, block_for_reflow, svg_mapping_data, font_scale=font_scale, char_space=char_space)
             else:
+                # Segments découpés une seule fois pour toutes les tentatives
+                pretokenized = _pretokenize_segments(segments)
+
                 # 1. Premier calcul standard (fs=1.0)
-                lines = calculate_reflow(segments, block_for_reflow, svg_mapping_data)
+                lines = calculate_reflow(segments, block_for_reflow, svg_mapping_data, pretokenized=pretokenized)
                 
                 # 2. Si ça déborde, on lance la compression intelligente
                 if len(lines) > block['lignes_originales']:
@@ -1223,19 +1402,26 @@ def create_text_overlay_pdf(format_data, translation_data, svg_mapping_data, tem
                     # Tri décroissant impératif : on veut la plus grande police qui rentre
                     test_range = sorted(list(candidates), reverse=True)
 
-                    for fs_test in test_range:
+                    def try_fit(fs_test):
                         # Ajustement léger de l'espacement lettres pour aider la compression
                         cs_test = -0.1 if fs_test > 0.85 else -0.2
                         
-                        lines_test = calculate_reflow(segments, block_for_reflow, svg_mapping_data, font_scale=fs_test, char_space=cs_test)
-                        
+                        lines_test = calculate_reflow(segments, block_for_reflow, svg_mapping_data, font_scale=fs_test, char_space=cs_test,
+                                                      pretokenized=pretokenized, count_only=True)
                         if len(lines_test) <= block['lignes_originales']:
-                            lines = lines_test
-                            # On n'affiche le message que si la compression est significative (< 0.98)
-                            if fs_test < 0.98:
-                                print(f" {block_for_reflow['id']} -> Compression dynamique appliquée : fs={fs_test:.2f}, cs={cs_test:.2f}")
-                            is_fitted = True
-                            break
+                            return cs_test
+                        return None
+
+                    # Une police plus petite tient toujours si la précédente tenait : dichotomie
+                    fs_test, cs_test = _first_fitting(test_range, try_fit)
+                    if cs_test is not None:
+                        # Lignes complètes construites pour la seule taille retenue
+                        lines = calculate_reflow(segments, block_for_reflow, svg_mapping_data, font_scale=fs_test, char_space=cs_test,
+                                                 pretokenized=pretokenized)
+                        # On n'affiche le message que si la compression est significative (< 0.98)
+                        if fs_test < 0.98:
+                            print(f" {block_for_reflow['id']} -> Compression dynamique appliquée : fs={fs_test:.2f}, cs={cs_test:.2f}")
+                        is_fitted = True
                     
                     if not is_fitted:
                         print(f" -> [AVERTISSEMENT] {block_for_reflow['id']} : Impossible de faire tenir le texte (Best effort conservé).")
@@ -4,9 +4,9 @@
 Gestionnaire d'état pour undo/redo et gestion de session complète
 """
 
-import copy
 import json
 import os
+import pickle
 from typing import List, Any, Optional
 
 
@@ -22,7 +22,9 @@ class StateManager:
         Args:
             session_file (str, optional): Chemin du fichier de session JSON.
         """
-        self.history: List[Any] = []
+        # États sérialisés (pickle) : plus compacts et plus rapides à copier
+        # qu'un deepcopy, chaque restauration produit un nouvel objet
+        self.history: List[bytes] = []
         self.history_index = -1
         self.session_file = session_file
         self.session_data = {
@@ -39,7 +41,7 @@ class StateManager:
 
     def save_state(self, state: Any) -> None:
         """
-        Sauvegarder l'état actuel (copie profonde).
+        Sauvegarder l'état actuel (instantané sérialisé).
         
         Args:
             state: État à sauvegarder
@@ -51,7 +53,7 @@ class StateManager:
         if self.history_index < len(self.history) - 1:
             self.history = self.history[:self.history_index + 1]
         
-        self.history.append(copy.deepcopy(state))
+        self.history.append(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
         self.history_index += 1
     
     def can_undo(self) -> bool:
@@ -64,13 +66,13 @@ class StateManager:
         if not self.can_undo():
             return None
         self.history_index -= 1
-        return copy.deepcopy(self.history[self.history_index])
+        return pickle.loads(self.history[self.history_index])
     
     def redo(self) -> Optional[Any]:
         if not self.can_redo():
             return None
         self.history_index += 1
-        return copy.deepcopy(self.history[self.history_index])
+        return pickle.loads(self.history[self.history_index])
     
     def clear(self) -> None:
         self.history.clear()
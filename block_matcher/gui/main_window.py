@@ -298,9 +298,8 @@ class BlockValidationInterface(QMainWindow):
                 translation_overrides=overrides  # <--- PASSAGE DES CORRECTIONS ICI
             )
 
-            # Générer le formatage AVANT la traduction (ordre important)
-            formatting_data = generator._generate_formatting_format(self.session_data['enriched_data'])
-            translation_data = generator._generate_translation_format(self.session_data['enriched_data'])
+            # Styles globaux collectés avant la traduction, en un seul parcours
+            translation_data, formatting_data = generator._generate_both_formats(self.session_data['enriched_data'])
 
             # Mettre à jour la session avec les styles mis à jour du générateur
             self.session_data['global_styles'] = {
@@ -1599,8 +1598,7 @@ class BlockValidationInterface(QMainWindow):
                                 block['max_allowable_width'] = (bbox[2] - bbox[0]) * page_dims[0]
 
             # GÉNÉRER LES 3 FICHIERS
-            formatting_data = generator._generate_formatting_format(self.data_manager.enriched_data)
-            translation_data = generator._generate_translation_format(self.data_manager.enriched_data)
+            translation_data, formatting_data = generator._generate_both_formats(self.data_manager.enriched_data)
 
             # Mettre à jour session avec styles
             self.session_data['global_styles'] = {